@@ -4,11 +4,13 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import openai
-from collections import defaultdict
+from functools import lru_cache
+import re
 
 # 自作ロジックモジュールをインポート
 import logic
+import generation_cache
+import openai_client
 
 # ページ設定
 st.set_page_config(
@@ -103,28 +105,21 @@ def check_password():
     return False
 
 # OpenAIクライアント取得
-@st.cache_resource
 def get_openai_client():
-    """OpenAI クライアントを取得"""
+    """OpenAI クライアントを取得（APIキーごとの共有はopenai_clientが行う。キー未設定ならNone）"""
     try:
-        api_key = st.secrets.get("openai", {}).get("api_key")
-        if not api_key:
-            return None
-        return openai.OpenAI(api_key=api_key)
+        return openai_client.get_openai_client()
     except Exception as e:
         st.error(f"OpenAI クライアント初期化エラー: {e}")
         return None
 
 # 期間でデータをフィルタリング
 def filter_by_period(df, months_back=2):
-    """指定した期間でデータをフィルタリング"""
+    """指定した期間でデータをフィルタリング（投稿ストアのデータを日時順のまま渡す）"""
     if df.empty:
         return df
     
-    df_temp = df.copy()
-    df_temp['submission_date'] = pd.to_datetime(df_temp['submission_date'])
-    cutoff_date = datetime.now() - timedelta(days=months_back * 30)
-    return df_temp[df_temp['submission_date'] > cutoff_date]
+    return logic.filter_recent_posts(df, months_back * 30, sorted_by_time=True)
 
 # 基本統計の計算
 def calculate_basic_stats(df):
@@ -144,15 +139,12 @@ def calculate_basic_stats(df):
     affected_municipalities = df['event_municipality'].dropna().nunique()
     
     # 前月比の成長率計算
-    df_temp = df.copy()
-    df_temp['submission_date'] = pd.to_datetime(df_temp['submission_date'])
-    
     last_month = datetime.now() - timedelta(days=30)
     prev_month = datetime.now() - timedelta(days=60)
     
-    current_count = len(df_temp[df_temp['submission_date'] > last_month])
-    prev_count = len(df_temp[(df_temp['submission_date'] > prev_month) & 
-                            (df_temp['submission_date'] <= last_month)])
+    # dfはfilter_by_periodの結果なので日時順に並んでいる
+    current_count = len(logic.filter_by_submission_period(df, start=last_month, sorted_by_time=True))
+    prev_count = len(logic.filter_by_submission_period(df, start=prev_month, end=last_month, sorted_by_time=True))
     
     growth_rate = ((current_count - prev_count) / max(prev_count, 1)) * 100 if prev_count > 0 else 0
     
@@ -165,178 +157,209 @@ def calculate_basic_stats(df):
     }
 
 # 理由を社会課題カテゴリに分類
+REASON_CATEGORY_KEYWORDS = {
+    '子育て・ケア': ['子ども', '託児', '授乳', 'おむつ', '子育て', '介護'],
+    '労働・時間': ['仕事', '会社', '残業', 'シフト', '有給', '時間'],
+    '経済・費用': ['参加費', '交通費', '宿泊費', '高額', '負担'],
+    '情報・機会': ['情報', '締切', '定員', '知る'],
+    '健康・その他': ['体調', '病気', '天候', 'その他']
+}
+
+# カテゴリごとにキーワードを1つの正規表現にまとめる
+_CATEGORY_PATTERNS = [
+    (category, re.compile('|'.join(re.escape(keyword) for keyword in keywords)))
+    for category, keywords in REASON_CATEGORY_KEYWORDS.items()
+]
+
+@lru_cache(maxsize=4096)
+def _match_reason_categories(reason):
+    """理由1件が該当するカテゴリ（該当なしは空タプル）"""
+    reason_lower = reason.lower()
+    return tuple(category for category, pattern in _CATEGORY_PATTERNS if pattern.search(reason_lower))
+
+# 選択肢の理由は起動時に分類しておき、自由記述だけを都度マッチングする
+REASON_CATEGORIES = {reason: _match_reason_categories(reason) for reason in logic.KNOWN_REASONS}
+
+def _reason_categories(reason):
+    categories = REASON_CATEGORIES.get(reason)
+    return categories if categories is not None else _match_reason_categories(reason)
+
 def categorize_reasons(reasons_text):
     """理由を社会課題カテゴリに分類"""
-    categories = {
-        '子育て・ケア': ['子ども', '託児', '授乳', 'おむつ', '子育て', '介護'],
-        '労働・時間': ['仕事', '会社', '残業', 'シフト', '有給', '時間'],
-        '経済・費用': ['参加費', '交通費', '宿泊費', '高額', '負担'],
-        '情報・機会': ['情報', '締切', '定員', '知る'],
-        '健康・その他': ['体調', '病気', '天候', 'その他']
-    }
-    
-    result_categories = []
-    reasons_lower = str(reasons_text).lower()
-    
-    for category, keywords in categories.items():
-        if any(keyword in reasons_lower for keyword in keywords):
-            result_categories.append(category)
+    matched = set()
+    for reason in str(reasons_text).split('|'):
+        matched.update(_reason_categories(reason))
     
+    result_categories = [category for category in REASON_CATEGORY_KEYWORDS if category in matched]
     return result_categories if result_categories else ['その他']
 
+def explode_categories(df):
+    """reasons列を (post, category) の縦持ちテーブルに展開する
+
+    カテゴリは投稿ごとに重複を除き、どのカテゴリにも該当しない投稿は「その他」とする。
+    """
+    reasons = logic.explode_reasons(df)
+    
+    # 異なる理由文字列ごとに1回だけ分類し、コード経由で結合する
+    reason_codes = reasons['reason'].cat.codes.to_numpy()
+    lookup = pd.DataFrame(
+        [(code, category)
+         for code, reason in enumerate(reasons['reason'].cat.categories)
+         for category in _reason_categories(reason)],
+        columns=['code', 'category']
+    )
+    categories = pd.DataFrame({'post': reasons['post'].to_numpy(), 'code': reason_codes})
+    categories = categories.merge(lookup, on='code')[['post', 'category']].drop_duplicates()
+    
+    if 'reasons' in df.columns:
+        uncategorized = df.index[df['reasons'].notna()].difference(pd.Index(categories['post'].unique()))
+        if len(uncategorized) > 0:
+            categories = pd.concat([categories, pd.DataFrame({'post': uncategorized, 'category': 'その他'})])
+    
+    categories['category'] = pd.Categorical(
+        categories['category'], categories=list(REASON_CATEGORY_KEYWORDS) + ['その他']
+    )
+    return categories.reset_index(drop=True)
+
+def count_categories(df, category_table=None):
+    """カテゴリごとの投稿数を多い順に返す（index: カテゴリ, 値: 件数）"""
+    if category_table is None:
+        category_table = explode_categories(df)
+    counts = category_table['category'].value_counts()
+    return counts[counts > 0]
+
+def category_prefecture_incidence(df, category_table=None):
+    """カテゴリ×都道府県の投稿数表（index: カテゴリ, columns: 都道府県）
+
+    オンライン開催や開催地未入力の投稿は都道府県として数えない。
+    """
+    if category_table is None:
+        category_table = explode_categories(df)
+    prefectures = df['event_prefecture'].loc[category_table['post']].to_numpy()
+    regional = np.isin(prefectures, list(logic.PREFECTURE_LOCATIONS))
+    return pd.crosstab(category_table['category'].to_numpy()[regional], prefectures[regional])
+
+def prefectures_by_category(incidence):
+    """カテゴリごとに、投稿のある都道府県を投稿数の多い順に並べたリスト"""
+    return {
+        category: row[row > 0].sort_values(ascending=False, kind='stable').index.tolist()
+        for category, row in incidence.iterrows()
+    }
+
+# グループ別集計エンジン
+def _top_value_by_group(keys, values):
+    """グループごとに最も多い値を返す（index: グループ）"""
+    pairs = pd.DataFrame({'key': np.asarray(keys, dtype=object), 'value': np.asarray(values, dtype=object)})
+    counts = pairs.groupby(['key', 'value'], sort=False).size()
+    if counts.empty:
+        return pd.Series(dtype=object)
+    top = counts.sort_values(ascending=False, kind='stable').reset_index().drop_duplicates('key')
+    return top.set_index('key')['value']
+
+def summarize_by_group(df, key):
+    """key列のグループごとの指標を、投稿・(投稿, 理由)・(投稿, カテゴリ)への1回ずつのgroupbyで求める"""
+    if df.empty:
+        return pd.DataFrame(columns=[
+            'post_count', 'event_count', 'municipality_count', 'prefecture', 'latest_post',
+            'main_location', 'top_reason', 'reason_diversity', 'top_category'
+        ])
+    
+    groups = df.groupby(key, sort=False)
+    summary = pd.DataFrame({
+        'post_count': groups.size(),
+        'event_count': groups['event_name'].nunique(),
+        'municipality_count': groups['event_municipality'].nunique(),
+        'prefecture': groups['event_prefecture'].first(),
+        'latest_post': groups['submission_date'].max(),
+    })
+    summary['main_location'] = _top_value_by_group(df[key], df['event_prefecture'])
+    
+    # 理由: (投稿, 理由) テーブルにグループを付けて集計
+    reasons = logic.explode_reasons(df)
+    reason_keys = df[key].loc[reasons['post']].to_numpy()
+    summary['top_reason'] = _top_value_by_group(reason_keys, reasons['reason'])
+    summary['reason_diversity'] = pd.Series(reasons['reason'].to_numpy(), index=reason_keys).groupby(level=0).nunique()
+    
+    # カテゴリ: (投稿, カテゴリ) テーブルにグループを付けて集計
+    categories = explode_categories(df)
+    summary['top_category'] = _top_value_by_group(
+        df[key].loc[categories['post']].to_numpy(), categories['category'].astype(object)
+    )
+    
+    summary['top_reason'] = summary['top_reason'].fillna('データなし')
+    summary['reason_diversity'] = summary['reason_diversity'].fillna(0).astype(int)
+    summary['top_category'] = summary['top_category'].fillna('その他')
+    return summary.sort_values('post_count', ascending=False, kind='stable')
+
+def _priority(count, high, medium):
+    """投稿数から優先度を判定"""
+    if count >= high:
+        return "高"
+    elif count >= medium:
+        return "中"
+    return "低"
+
 # イベント主催者向けデータ分析
 def analyze_for_event_organizers(df, min_posts=5):
     """イベント主催者向けの分析データを生成"""
-    event_analysis = []
-    
-    # イベント別の集計
-    event_counts = df['event_name'].value_counts()
+    summary = summarize_by_group(df, 'event_name')
+    summary = summary[summary['post_count'] >= min_posts]
     
-    for event_name, count in event_counts.items():
-        if count < min_posts:
-            continue
-            
-        event_df = df[df['event_name'] == event_name]
-        
-        # 理由の分析
-        all_reasons = []
-        for reasons_str in event_df['reasons'].dropna():
-            all_reasons.extend(str(reasons_str).split('|'))
-        
-        reason_counts = pd.Series(all_reasons).value_counts()
-        top_reason = reason_counts.index[0] if len(reason_counts) > 0 else 'データなし'
-        
-        # 優先度の判定
-        if count >= 15:
-            priority = "高"
-        elif count >= 10:
-            priority = "中"
-        else:
-            priority = "低"
-        
-        # 開催地の分析
-        locations = event_df['event_prefecture'].value_counts()
-        main_location = locations.index[0] if len(locations) > 0 else 'データなし'
-        
-        event_analysis.append({
+    return [
+        {
             'event_name': event_name,
-            'post_count': count,
-            'priority': priority,
-            'top_reason': top_reason,
-            'main_location': main_location,
-            'reason_diversity': len(reason_counts),
-            'latest_post': event_df['submission_date'].max()
-        })
-    
-    return sorted(event_analysis, key=lambda x: x['post_count'], reverse=True)
+            'post_count': row['post_count'],
+            'priority': _priority(row['post_count'], 15, 10),
+            'top_reason': row['top_reason'],
+            'main_location': row['main_location'] if pd.notna(row['main_location']) else 'データなし',
+            'reason_diversity': row['reason_diversity'],
+            'latest_post': row['latest_post']
+        }
+        for event_name, row in summary.iterrows()
+    ]
 
 # 自治体向けデータ分析
 def analyze_for_government(df, min_posts=3):
     """自治体向けの分析データを生成"""
-    municipal_analysis = []
-    
     # 市区町村別の集計（空文字を除く）
     municipal_df = df[df['event_municipality'].notna() & (df['event_municipality'] != '')]
-    municipal_counts = municipal_df['event_municipality'].value_counts()
+    summary = summarize_by_group(municipal_df, 'event_municipality')
+    summary = summary[summary['post_count'] >= min_posts]
     
-    for municipality, count in municipal_counts.items():
-        if count < min_posts:
-            continue
-            
-        muni_df = municipal_df[municipal_df['event_municipality'] == municipality]
-        
-        # 理由の分析
-        all_reasons = []
-        for reasons_str in muni_df['reasons'].dropna():
-            all_reasons.extend(str(reasons_str).split('|'))
-        
-        reason_counts = pd.Series(all_reasons).value_counts()
-        top_reason = reason_counts.index[0] if len(reason_counts) > 0 else 'データなし'
-        
-        # カテゴリ分析
-        categories = defaultdict(int)
-        for reasons_str in muni_df['reasons'].dropna():
-            cats = categorize_reasons(reasons_str)
-            for cat in cats:
-                categories[cat] += 1
-        
-        top_category = max(categories.items(), key=lambda x: x[1])[0] if categories else 'その他'
-        
-        # 優先度の判定
-        if count >= 10:
-            priority = "高"
-        elif count >= 6:
-            priority = "中"
-        else:
-            priority = "低"
-        
-        # 都道府県の取得
-        prefecture = muni_df['event_prefecture'].iloc[0] if len(muni_df) > 0 else 'データなし'
-        
-        municipal_analysis.append({
+    return [
+        {
             'municipality': municipality,
-            'prefecture': prefecture,
-            'post_count': count,
-            'priority': priority,
-            'top_reason': top_reason,
-            'top_category': top_category,
-            'event_count': muni_df['event_name'].nunique(),
-            'latest_post': muni_df['submission_date'].max()
-        })
-    
-    return sorted(municipal_analysis, key=lambda x: x['post_count'], reverse=True)
+            'prefecture': row['prefecture'],
+            'post_count': row['post_count'],
+            'priority': _priority(row['post_count'], 10, 6),
+            'top_reason': row['top_reason'],
+            'top_category': row['top_category'],
+            'event_count': row['event_count'],
+            'latest_post': row['latest_post']
+        }
+        for municipality, row in summary.iterrows()
+    ]
 
 # 都道府県・企業向けデータ分析
 def analyze_for_corporate(df, min_posts=5):
     """都道府県・企業向けの分析データを生成"""
-    prefecture_analysis = []
-    
-    # 都道府県別の集計
-    pref_counts = df['event_prefecture'].value_counts()
+    regional_df = df[df['event_prefecture'] != 'オンライン・Web開催']
+    summary = summarize_by_group(regional_df, 'event_prefecture')
+    summary = summary[summary['post_count'] >= min_posts]
     
-    for prefecture, count in pref_counts.items():
-        if count < min_posts or prefecture == 'オンライン・Web開催':
-            continue
-            
-        pref_df = df[df['event_prefecture'] == prefecture]
-        
-        # カテゴリ分析
-        categories = defaultdict(int)
-        for reasons_str in pref_df['reasons'].dropna():
-            cats = categorize_reasons(reasons_str)
-            for cat in cats:
-                categories[cat] += 1
-        
-        top_category = max(categories.items(), key=lambda x: x[1])[0] if categories else 'その他'
-        
-        # 優先度の判定
-        if count >= 20:
-            priority = "高"
-        elif count >= 10:
-            priority = "中"
-        else:
-            priority = "低"
-        
-        # 主要な問題
-        all_reasons = []
-        for reasons_str in pref_df['reasons'].dropna():
-            all_reasons.extend(str(reasons_str).split('|'))
-        
-        reason_counts = pd.Series(all_reasons).value_counts()
-        top_reason = reason_counts.index[0] if len(reason_counts) > 0 else 'データなし'
-        
-        prefecture_analysis.append({
+    return [
+        {
             'prefecture': prefecture,
-            'post_count': count,
-            'priority': priority,
-            'top_category': top_category,
-            'top_reason': top_reason,
-            'event_count': pref_df['event_name'].nunique(),
-            'municipality_count': pref_df['event_municipality'].nunique(),
-            'latest_post': pref_df['submission_date'].max()
-        })
-    
-    return sorted(prefecture_analysis, key=lambda x: x['post_count'], reverse=True)
+            'post_count': row['post_count'],
+            'priority': _priority(row['post_count'], 20, 10),
+            'top_category': row['top_category'],
+            'top_reason': row['top_reason'],
+            'event_count': row['event_count'],
+            'municipality_count': row['municipality_count'],
+            'latest_post': row['latest_post']
+        }
+        for prefecture, row in summary.iterrows()
+    ]
 
 # メディア向けデータ分析
 def analyze_for_media(df):
@@ -344,35 +367,22 @@ def analyze_for_media(df):
     media_stories = []
     
     # カテゴリ別の問題集計
-    categories = defaultdict(int)
-    for reasons_str in df['reasons'].dropna():
-        cats = categorize_reasons(reasons_str)
-        for cat in cats:
-            categories[cat] += 1
+    category_table = explode_categories(df)
+    categories = count_categories(df, category_table)
     
-    # 急増している問題の検出
-    df_temp = df.copy()
-    df_temp['submission_date'] = pd.to_datetime(df_temp['submission_date'])
+    # カテゴリごとの地域への広がり（カテゴリ×都道府県の出現表から求める）
+    regions = prefectures_by_category(category_prefecture_incidence(df, category_table))
     
+    # 急増している問題の検出
     # 直近30日 vs 前30日の比較
     recent_30 = datetime.now() - timedelta(days=30)
     prev_30 = datetime.now() - timedelta(days=60)
     
-    recent_df = df_temp[df_temp['submission_date'] > recent_30]
-    prev_df = df_temp[(df_temp['submission_date'] > prev_30) & (df_temp['submission_date'] <= recent_30)]
+    recent_df = logic.filter_by_submission_period(df, start=recent_30, sorted_by_time=True)
+    prev_df = logic.filter_by_submission_period(df, start=prev_30, end=recent_30, sorted_by_time=True)
     
-    recent_categories = defaultdict(int)
-    prev_categories = defaultdict(int)
-    
-    for reasons_str in recent_df['reasons'].dropna():
-        cats = categorize_reasons(reasons_str)
-        for cat in cats:
-            recent_categories[cat] += 1
-    
-    for reasons_str in prev_df['reasons'].dropna():
-        cats = categorize_reasons(reasons_str)
-        for cat in cats:
-            prev_categories[cat] += 1
+    recent_categories = count_categories(recent_df)
+    prev_categories = count_categories(prev_df)
     
     # 各カテゴリの分析
     for category, recent_count in recent_categories.items():
@@ -402,23 +412,47 @@ def analyze_for_media(df):
             'growth_rate': growth_rate,
             'news_value': news_value,
             'story_angle': story_angle,
-            'prefecture_spread': len(df[df['reasons'].str.contains('|'.join([r for r in df['reasons'] if category in str(r)]), na=False)]['event_prefecture'].unique()) if not df.empty else 0
+            'prefecture_spread': len(regions.get(category, [])),
+            'prefectures': regions.get(category, [])
         })
     
     return sorted(media_stories, key=lambda x: (x['news_value'] == '高', x['total_count']), reverse=True)
 
+# 分析結果キャッシュ
+STAKEHOLDER_ANALYZERS = {
+    'event': analyze_for_event_organizers,
+    'government': analyze_for_government,
+    'corporate': analyze_for_corporate,
+}
+
+@st.cache_data(ttl=600, max_entries=24)  # 「直近30日」などが古くならないよう時間でも失効させる
+def _get_period_analysis(revision, months_back):
+    """データリビジョン・期間ごとに全ステークホルダーの分析を1回だけ計算"""
+    df = filter_by_period(logic.get_post_store().snapshot(), months_back)
+    return {
+        'stats': calculate_basic_stats(df),
+        # 閾値は後からフィルタで適用するため、全グループ分を保持する
+        **{kind: analyzer(df, min_posts=1) for kind, analyzer in STAKEHOLDER_ANALYZERS.items()},
+        'media': analyze_for_media(df),
+    }
+
+def get_period_analysis(months_back):
+    """現在のデータに対する期間別の分析結果"""
+    return _get_period_analysis(logic.get_data_revision(), months_back)
+
+def get_stakeholder_analysis(kind, months_back, min_posts):
+    """キャッシュ済みの分析結果を最小投稿数で絞り込んで返す"""
+    return [item for item in get_period_analysis(months_back)[kind] if item['post_count'] >= min_posts]
+
 # 詳細グラフ生成
 def create_detailed_charts(target_df, df_all, target_name, target_type):
     """詳細なグラフを生成"""
     charts_data = {}
     
     # 1. 理由別分布グラフ
-    all_reasons = []
-    for reasons_str in target_df['reasons'].dropna():
-        all_reasons.extend(str(reasons_str).split('|'))
+    reason_counts = logic.count_reasons(target_df)
     
-    if all_reasons:
-        reason_counts = pd.Series(all_reasons).value_counts()
+    if not reason_counts.empty:
         reason_df = pd.DataFrame({
             '理由': reason_counts.index[:8],
             '件数': reason_counts.values[:8]
@@ -438,17 +472,13 @@ def create_detailed_charts(target_df, df_all, target_name, target_type):
         charts_data['top_reason_count'] = reason_df.iloc[0]['件数']
     
     # 2. カテゴリ別分析グラフ
-    categories = defaultdict(int)
-    for reasons_str in target_df['reasons'].dropna():
-        cats = categorize_reasons(reasons_str)
-        for cat in cats:
-            categories[cat] += 1
+    categories = count_categories(target_df)
     
-    if categories:
-        cat_df = pd.DataFrame([
-            {'カテゴリ': cat, '件数': count}
-            for cat, count in sorted(categories.items(), key=lambda x: x[1], reverse=True)
-        ])
+    if not categories.empty:
+        cat_df = pd.DataFrame({
+            'カテゴリ': categories.index.astype(str),
+            '件数': categories.values
+        })
         
         fig_categories = px.pie(
             cat_df,
@@ -462,7 +492,6 @@ def create_detailed_charts(target_df, df_all, target_name, target_type):
     # 3. 時系列トレンドグラフ
     if len(target_df) > 1:
         trend_df = target_df.copy()
-        trend_df['submission_date'] = pd.to_datetime(trend_df['submission_date'])
         trend_df['年月'] = trend_df['submission_date'].dt.to_period('M').astype(str)
         
         monthly_counts = trend_df.groupby('年月').size().reset_index(name='投稿数')
@@ -484,7 +513,7 @@ def create_detailed_charts(target_df, df_all, target_name, target_type):
         charts_data['target_stats'] = {
             'total_posts': len(target_df),
             'percentage': target_rate,
-            'unique_reasons': len(set(all_reasons)) if all_reasons else 0
+            'unique_reasons': len(reason_counts)
         }
     
     return charts_data
@@ -508,8 +537,8 @@ def generate_detailed_report(target_type, target_name, analysis_data, target_df,
         chart_analysis += f"**投稿状況**: 総{stats['total_posts']}件（全体の{stats['percentage']:.1f}%）\n"
         chart_analysis += f"**課題の多様性**: {stats['unique_reasons']}種類の異なる課題\n\n"
     
-    # サンプル投稿
-    samples = target_df.sample(min(3, len(target_df))) if len(target_df) > 0 else pd.DataFrame()
+    # サンプル投稿（同じデータなら同じ事例を選び、プロンプトをキャッシュ可能にする）
+    samples = target_df.sample(min(3, len(target_df)), random_state=0) if len(target_df) > 0 else pd.DataFrame()
     sample_text = "## 💬 代表的な声\n\n"
     for i, (_, row) in enumerate(samples.iterrows(), 1):
         sample_text += f"**【事例{i}】**\n"
@@ -598,12 +627,12 @@ def generate_detailed_report(target_type, target_name, analysis_data, target_df,
     config = stakeholder_prompts[target_type]
     
     try:
-        response = client.chat.completions.create(
+        # 同じ対象・同じデータでの再生成はキャッシュから返す
+        report_body = generation_cache.complete_chat(
+            client,
             model="gpt-4o-mini",  # コスト効率重視
-            messages=[
-                {"role": "system", "content": config["system"]},
-                {"role": "user", "content": config["prompt"]}
-            ],
+            system_prompt=config["system"],
+            user_prompt=config["prompt"],
             temperature=0.7,
             max_tokens=1500
         )
@@ -615,7 +644,7 @@ def generate_detailed_report(target_type, target_name, analysis_data, target_df,
 
 ---
 
-{response.choices[0].message.content}
+{report_body}
 
 ---
 
@@ -654,8 +683,8 @@ def main():
     # 期間でフィルタリング
     df = filter_by_period(df_all, months_back)
     
-    # 基本統計
-    stats = calculate_basic_stats(df)
+    # 基本統計（分析結果はデータリビジョン・期間ごとにキャッシュ）
+    stats = get_period_analysis(months_back)['stats']
     
     # サイドバーに基本統計表示
     st.sidebar.markdown("### 📊 基本統計")
@@ -665,6 +694,20 @@ def main():
     st.sidebar.metric("影響市区町村", f"{stats['affected_municipalities']}市区町村")
     st.sidebar.metric("前月比", f"{stats['growth_rate']:+.1f}%")
     
+    # AI生成キャッシュの利用状況
+    cache_stats = generation_cache.get_generation_cache().stats()
+    st.sidebar.caption(
+        f"🤖 AI生成キャッシュ: ヒット {cache_stats['hits']}件 / ミス {cache_stats['misses']}件（保存 {cache_stats['entries']}件）"
+    )
+    
+    # AI生成の速度（このプロセスでの直近の計測）
+    for model, metrics in openai_client.get_stream_metrics().summary().items():
+        ttft = f"{metrics['avg_ttft']:.2f}秒" if metrics['avg_ttft'] is not None else "-"
+        speed = f"{metrics['avg_tokens_per_sec']:.0f} tok/秒" if metrics['avg_tokens_per_sec'] is not None else "-"
+        st.sidebar.caption(
+            f"⏱️ {model}: {metrics['requests']}回 / 初回応答 {ttft} / 全体 {metrics['avg_latency']:.2f}秒 / {speed}"
+        )
+    
     if df.empty:
         st.warning(f"過去{months_back}ヶ月間のデータがありません。期間を長くするか、データの投稿をお待ちください。")
         return
@@ -682,7 +725,7 @@ def main():
         st.subheader("🎯 アプローチすべきイベント主催者")
         
         min_posts_event = st.selectbox("最小投稿数", [3, 5, 8, 10], index=1, key="event_min")
-        event_analysis = analyze_for_event_organizers(df, min_posts_event)
+        event_analysis = get_stakeholder_analysis('event', months_back, min_posts_event)
         
         if not event_analysis:
             st.info(f"過去{months_back}ヶ月間で{min_posts_event}件以上の投稿があるイベントはありません。")
@@ -829,7 +872,7 @@ def main():
         st.subheader("🎯 アプローチすべき自治体")
         
         min_posts_gov = st.selectbox("最小投稿数", [2, 3, 5, 8], index=1, key="gov_min")
-        gov_analysis = analyze_for_government(df, min_posts_gov)
+        gov_analysis = get_stakeholder_analysis('government', months_back, min_posts_gov)
         
         if not gov_analysis:
             st.info(f"過去{months_back}ヶ月間で{min_posts_gov}件以上の投稿がある市区町村はありません。")
@@ -976,7 +1019,7 @@ def main():
         st.subheader("🎯 アプローチすべき都道府県・企業")
         
         min_posts_corp = st.selectbox("最小投稿数", [5, 8, 10, 15], index=1, key="corp_min")
-        corp_analysis = analyze_for_corporate(df, min_posts_corp)
+        corp_analysis = get_stakeholder_analysis('corporate', months_back, min_posts_corp)
         
         if not corp_analysis:
             st.info(f"過去{months_back}ヶ月間で{min_posts_corp}件以上の投稿がある都道府県はありません。")
@@ -1126,7 +1169,7 @@ def main():
     with tab4:
         st.subheader("🎯 メディアに提案すべき社会課題")
         
-        media_analysis = analyze_for_media(df)
+        media_analysis = get_period_analysis(months_back)['media']
         
         if not media_analysis:
             st.info("現在、特に報道価値の高い課題は検出されていません。")
@@ -1148,7 +1191,7 @@ def main():
                         <h4>{icon} {story['category']}の課題</h4>
                         <p><strong>ニュース価値:</strong> {story['news_value']} | <strong>ストーリー角度:</strong> {story['story_angle']}</p>
                         <p><strong>総投稿数:</strong> {story['total_count']}件 | <strong>直近30日:</strong> {story['recent_count']}件</p>
-                        <p><strong>地域への広がり:</strong> {story['prefecture_spread']}都道府県</p>
+                        <p><strong>地域への広がり:</strong> {story['prefecture_spread']}都道府県（主な地域: {'、'.join(story['prefectures'][:5]) or 'データなし'}）</p>
                     </div>
                     ''', unsafe_allow_html=True)
     
@@ -1159,7 +1202,7 @@ def main():
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        event_count = len(analyze_for_event_organizers(df, 5))
+        event_count = len(get_stakeholder_analysis('event', months_back, 5))
         st.markdown(f'''
         <div class="metric-box">
             <h3>{event_count}</h3>
@@ -1168,7 +1211,7 @@ def main():
         ''', unsafe_allow_html=True)
     
     with col2:
-        gov_count = len(analyze_for_government(df, 3))
+        gov_count = len(get_stakeholder_analysis('government', months_back, 3))
         st.markdown(f'''
         <div class="metric-box">
             <h3>{gov_count}</h3>
@@ -1177,7 +1220,7 @@ def main():
         ''', unsafe_allow_html=True)
     
     with col3:
-        corp_count = len(analyze_for_corporate(df, 8))
+        corp_count = len(get_stakeholder_analysis('corporate', months_back, 8))
         st.markdown(f'''
         <div class="metric-box">
             <h3>{corp_count}</h3>
@@ -1186,7 +1229,7 @@ def main():
         ''', unsafe_allow_html=True)
     
     with col4:
-        media_count = len([s for s in analyze_for_media(df) if s['news_value'] in ['高', '中']])
+        media_count = len([s for s in get_period_analysis(months_back)['media'] if s['news_value'] in ['高', '中']])
         st.markdown(f'''
         <div class="metric-box">
             <h3>{media_count}</h3>
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+import logic
+import openai_client
+
+# AI生成結果キャッシュの設定
+GENERATION_CACHE_FILE = os.path.join(logic.LOCAL_DATA_DIR, "generation_cache.sqlite3")
+GENERATION_CACHE_TTL = 7 * 24 * 60 * 60  # 生成結果を再利用する期間（秒）
+GENERATION_CACHE_MAX_ENTRIES = 2000  # これを超えたら最後に使われた時刻が古いものから削除
+REPLAY_CHUNK_SIZE = 4  # キャッシュ再生時に1回で返す文字数
+
+
+def make_generation_key(model, system_prompt, user_prompt, temperature):
+    """生成条件からキャッシュキー（SHA-256）を作成"""
+    payload = json.dumps(
+        [model, system_prompt, user_prompt, temperature],
+        ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """生成結果をSQLiteに保存する、TTL・件数上限付きのLRUキャッシュ"""
+
+    def __init__(self, path=GENERATION_CACHE_FILE, ttl=GENERATION_CACHE_TTL,
+                 max_entries=GENERATION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        """キャッシュ済みの生成結果を返す（なければNone）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def record_miss(self):
+        """キャッシュを使わずに生成したことを記録"""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, content):
+        """生成結果を保存し、期限切れと上限超過分を削除"""
+        if not content:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, content, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, now, now)
+            )
+            self._conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM generations WHERE key IN ("
+                "SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """ヒット数・ミス数・保存件数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+@st.cache_resource
+def get_generation_cache():
+    """プロセス全体で共有する生成結果キャッシュを取得"""
+    return GenerationCache()
+
+
+def replay(content, chunk_size=REPLAY_CHUNK_SIZE):
+    """キャッシュ済みの文章をストリーミングと同じ形で少しずつ返す"""
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+
+def stream_chat_completion(client, model, system_prompt, user_prompt, temperature, max_tokens, use_cache=True):
+    """チャット補完をストリーミングで返すジェネレーター（キャッシュがあれば再生する）
+
+    use_cache=Falseのときはキャッシュを読まずに生成し、結果で上書きする。
+    生成が最後まで終わった場合だけ保存する。
+    """
+    cache = get_generation_cache()
+    key = make_generation_key(model, system_prompt, user_prompt, temperature)
+
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            yield from replay(cached)
+            return
+    else:
+        cache.record_miss()
+
+    parts = []
+    for text in openai_client.stream_chat(
+        client,
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens
+    ):
+        parts.append(text)
+        yield text
+
+    cache.put(key, "".join(parts))
+
+
+def complete_chat(client, model, system_prompt, user_prompt, temperature, max_tokens, use_cache=True):
+    """チャット補完の本文を返す（キャッシュがあればAPIを呼ばない）"""
+    cache = get_generation_cache()
+    key = make_generation_key(model, system_prompt, user_prompt, temperature)
+
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    else:
+        cache.record_miss()
+
+    content = openai_client.complete_chat(
+        client,
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    cache.put(key, content)
+    return content
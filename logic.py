@@ -4,11 +4,12 @@ import json
 import os
 import hashlib
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import streamlit as st
 import gspread
 from google.oauth2.service_account import Credentials
 import time
+import threading
 from collections import defaultdict
 
 # ファイルパス設定
@@ -65,6 +66,57 @@ PREFECTURE_LOCATIONS = {
     "沖縄県": [26.2125, 127.68111],
 }
 
+# 都道府県庁所在地（検索結果の並び順で優先する）
+PREFECTURE_CAPITALS = {
+    "北海道": "札幌市",
+    "青森県": "青森市",
+    "岩手県": "盛岡市",
+    "宮城県": "仙台市",
+    "秋田県": "秋田市",
+    "山形県": "山形市",
+    "福島県": "福島市",
+    "茨城県": "水戸市",
+    "栃木県": "宇都宮市",
+    "群馬県": "前橋市",
+    "埼玉県": "さいたま市",
+    "千葉県": "千葉市",
+    "東京都": "新宿区",
+    "神奈川県": "横浜市",
+    "新潟県": "新潟市",
+    "富山県": "富山市",
+    "石川県": "金沢市",
+    "福井県": "福井市",
+    "山梨県": "甲府市",
+    "長野県": "長野市",
+    "岐阜県": "岐阜市",
+    "静岡県": "静岡市",
+    "愛知県": "名古屋市",
+    "三重県": "津市",
+    "滋賀県": "大津市",
+    "京都府": "京都市",
+    "大阪府": "大阪市",
+    "兵庫県": "神戸市",
+    "奈良県": "奈良市",
+    "和歌山県": "和歌山市",
+    "鳥取県": "鳥取市",
+    "島根県": "松江市",
+    "岡山県": "岡山市",
+    "広島県": "広島市",
+    "山口県": "山口市",
+    "徳島県": "徳島市",
+    "香川県": "高松市",
+    "愛媛県": "松山市",
+    "高知県": "高知市",
+    "福岡県": "福岡市",
+    "佐賀県": "佐賀市",
+    "長崎県": "長崎市",
+    "熊本県": "熊本市",
+    "大分県": "大分市",
+    "宮崎県": "宮崎市",
+    "鹿児島県": "鹿児島市",
+    "沖縄県": "那覇市",
+}
+
 # スプレッドシートの列の定義（generated_postを追加）
 SHEET_COLUMNS = [
     "id", "event_name", "event_url", "location", "event_date", 
@@ -75,6 +127,49 @@ SHEET_COLUMNS = [
     "reason_details"
 ]
 
+# 参加できなかった理由の選択肢（カテゴリ別に整理）
+IMPROVED_REASONS = {
+    "👶 子育て・家族関連": [
+        "子どもの預け先がない",
+        "託児サービスがない/高額",
+        "子どもが病気・体調不良",
+        "授乳・おむつ替えの設備不足",
+        "子連れ参加が困難な雰囲気",
+        "家族の介護が必要",
+        "家族の理解・協力が得られない"
+    ],
+    "💼 仕事・時間関連": [
+        "仕事の都合がつかない",
+        "会社で許可が降りなかった", 
+        "残業・緊急対応が入った",
+        "シフト勤務で調整困難",
+        "有給取得が難しい",
+        "参加が難しい時間"
+    ],
+    "💰 経済・アクセス関連": [
+        "参加費が高額",
+        "交通費が負担",
+        "遠方で参加困難",
+        "交通アクセスが悪い",
+        "宿泊費が負担"
+    ],
+    "📢 情報・その他": [
+        "開催情報を知るのが遅かった",
+        "申込み締切に間に合わなかった",
+        "定員に達していた",
+        "自分の体調不良",
+        "天候不良",
+        "その他"
+    ]
+}
+
+# 選択肢の理由ごとのビット位置（投稿ごとの理由をuint32のビット列で持つ）
+KNOWN_REASONS = [reason for reasons in IMPROVED_REASONS.values() for reason in reasons]
+REASON_BIT_INDEX = {reason: i for i, reason in enumerate(KNOWN_REASONS)}
+
+# 読み込み時に追加する派生列（シートには書き込まない）
+DERIVED_COLUMNS = ["reason_bits"]
+
 # Googleスプレッドシート関連の関数は既存のものを使用
 @st.cache_resource
 def get_gspread_client():
@@ -162,8 +257,8 @@ def retry_on_quota_error(func, max_retries=3, delay=2):
             raise
     return None
 
-def load_city_data():
-    """座標付き市区町村データを読み込む"""
+def _read_city_data_file():
+    """座標付き市区町村データファイルを読み込む"""
     try:
         if os.path.exists(CITY_DATA_FILE):
             with open(CITY_DATA_FILE, "r", encoding="utf-8") as f:
@@ -175,60 +270,168 @@ def load_city_data():
         print(f"市区町村データ読み込みエラー: {e}")
         return {}
 
+class CityGazetteer:
+    """市区町村データの検索用インデックス（プロセスごとに1回だけ構築）"""
+
+    def __init__(self, city_data):
+        self.city_data = city_data
+        # 都道府県ごとのソート済み市区町村リスト
+        self.municipalities = {
+            prefecture: sorted(cities.keys())
+            for prefecture, cities in city_data.items()
+        }
+        # (都道府県, 市区町村) -> 座標 の完全一致テーブル
+        self.coordinates = {
+            (prefecture, city_name): (coord_data.get('latitude'), coord_data.get('longitude'))
+            for prefecture, cities in city_data.items()
+            for city_name, coord_data in cities.items()
+        }
+        # 部分一致で解決した結果（見つからなかった場合も記録）
+        self._partial_matches = {}
+
+    def get_coordinates(self, prefecture, municipality):
+        """市区町村の座標を返す（完全一致 → 部分一致の順）"""
+        key = (prefecture, municipality)
+        if key in self.coordinates:
+            return self.coordinates[key]
+        if key not in self._partial_matches:
+            self._partial_matches[key] = self._find_partial_match(prefecture, municipality)
+        return self._partial_matches[key]
+
+    def _find_partial_match(self, prefecture, municipality):
+        for city_name, coord_data in self.city_data.get(prefecture, {}).items():
+            if municipality in city_name or city_name in municipality:
+                return coord_data.get('latitude'), coord_data.get('longitude')
+        return None, None
+
+@st.cache_resource
+def get_city_gazetteer():
+    """プロセス全体で共有する市区町村インデックスを取得"""
+    return CityGazetteer(_read_city_data_file())
+
+def load_city_data():
+    """座標付き市区町村データを読み込む"""
+    return get_city_gazetteer().city_data
+
 def get_municipalities(prefecture):
     """都道府県に対応する市区町村のリストを取得"""
-    city_data = load_city_data()
+    municipalities = get_city_gazetteer().municipalities
     
-    if prefecture in city_data:
-        return ["選択なし"] + sorted(list(city_data[prefecture].keys()))
+    if prefecture in municipalities:
+        return ["選択なし"] + municipalities[prefecture]
     else:
         return ["選択なし", "その他"]
 
 def get_municipality_coordinates(prefecture, municipality):
     """市町村の座標を取得"""
-    city_data = load_city_data()
-    
-    if prefecture in city_data:
-        if municipality in city_data[prefecture]:
-            coord_data = city_data[prefecture][municipality]
-            return coord_data.get('latitude'), coord_data.get('longitude')
-        
-        # 部分一致を試す
-        for city_name, coord_data in city_data[prefecture].items():
-            if municipality in city_name or city_name in municipality:
-                return coord_data.get('latitude'), coord_data.get('longitude')
-    
-    return None, None
+    return get_city_gazetteer().get_coordinates(prefecture, municipality)
+
+# 地域検索の結果上限
+LOCATION_SEARCH_LIMIT = 50
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()  # このノード以下で終わるキーを持つ市区町村
+
+class LocationSearchIndex:
+    """市区町村名・カナ・ひらがなの前方一致トライと文字バイグラム転置インデックス"""
+
+    def __init__(self, city_data):
+        self.prefectures = list(city_data.keys())
+        self.entries = []  # (表示名, 都道府県, 市区町村)
+        self.is_capital = []
+        self.prefecture_entry_ids = defaultdict(list)
+        self.exact = defaultdict(set)
+        self.trie = _TrieNode()
+        self.bigrams = defaultdict(set)
+        self._search_keys = []
+
+        for prefecture, cities in city_data.items():
+            capital = PREFECTURE_CAPITALS.get(prefecture)
+            for city_name, city_info in cities.items():
+                entry_id = len(self.entries)
+                self.entries.append((f"{prefecture} {city_name}", prefecture, city_name))
+                self.is_capital.append(bool(capital) and city_name.startswith(capital))
+                self.prefecture_entry_ids[prefecture].append(entry_id)
+
+                keys = [city_name] + [city_info[field] for field in ('city_kana', 'city_hiragana')
+                                      if city_info.get(field)]
+                self._search_keys.append(keys)
+                for key in keys:
+                    self.exact[key].add(entry_id)
+                    self._add_to_trie(key, entry_id)
+                    for i in range(len(key) - 1):
+                        self.bigrams[key[i:i + 2]].add(entry_id)
+
+    def _add_to_trie(self, key, entry_id):
+        node = self.trie
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            node.ids.add(entry_id)
+
+    def _prefix_matches(self, keyword):
+        node = self.trie
+        for char in keyword:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+    def _substring_matches(self, keyword):
+        if len(keyword) < 2:
+            return {entry_id for entry_id, keys in enumerate(self._search_keys)
+                    if any(keyword in key for key in keys)}
+        postings = sorted(
+            (self.bigrams.get(keyword[i:i + 2], set()) for i in range(len(keyword) - 1)),
+            key=len
+        )
+        if not postings or not postings[0]:
+            return set()
+        candidates = set.intersection(*postings)
+        # バイグラムが揃っていても連続しているとは限らないので検証する
+        return {entry_id for entry_id in candidates
+                if any(keyword in key for key in self._search_keys[entry_id])}
+
+    def _rank(self, entry_ids):
+        # 県庁所在地を優先し、それ以外は元データの並び順
+        return sorted(entry_ids, key=lambda entry_id: (not self.is_capital[entry_id], entry_id))
+
+    def search(self, keyword, limit=LOCATION_SEARCH_LIMIT):
+        """完全一致 → 前方一致 → 部分一致 → 都道府県名一致の順で候補を返す"""
+        results = [(prefecture, prefecture, "") for prefecture in self.prefectures if keyword in prefecture]
+        matched_prefectures = [prefecture for _, prefecture, _ in results]
+
+        seen = set()
+        tiers = (
+            lambda: self.exact.get(keyword, set()),
+            lambda: self._prefix_matches(keyword),
+            lambda: self._substring_matches(keyword),
+            lambda: {entry_id for prefecture in matched_prefectures
+                     for entry_id in self.prefecture_entry_ids[prefecture]},
+        )
+        for tier in tiers:
+            if len(results) >= limit:
+                break
+            for entry_id in self._rank(tier() - seen):
+                seen.add(entry_id)
+                results.append(self.entries[entry_id])
+
+        return results[:limit]
+
+@st.cache_resource
+def get_location_search_index():
+    """プロセス全体で共有する地域検索インデックスを取得"""
+    return LocationSearchIndex(load_city_data())
 
 def search_locations(keyword):
     """キーワードから都道府県+市区町村の候補を検索する関数"""
     if not keyword or len(keyword) < 2:
         return []
-        
-    city_data = load_city_data()
-    results = []
-    prefecture_only_results = []
     
-    for prefecture, cities in city_data.items():
-        prefecture_match = keyword in prefecture
-        
-        if prefecture_match:
-            prefecture_only_results.append((prefecture, prefecture, ""))
-        
-        for city_name, city_info in cities.items():
-            if (prefecture_match or 
-                keyword in city_name or 
-                ('city_kana' in city_info and keyword in city_info['city_kana']) or 
-                ('city_hiragana' in city_info and keyword in city_info['city_hiragana'])):
-                full_location = f"{prefecture} {city_name}"
-                results.append((full_location, prefecture, city_name))
-    
-    final_results = prefecture_only_results + results
-    
-    if len(final_results) > 50:
-        final_results = final_results[:50]
-        
-    return final_results
+    return get_location_search_index().search(keyword)
 
 def split_location(location_string):
     """選択された場所文字列から都道府県と市区町村を分離する関数"""
@@ -244,98 +447,542 @@ def split_location(location_string):
     else:
         return parts[0], ""
 
-# データ読み込み・保存関連の関数（既存）
+# 投稿データのインメモリストア設定
+POST_SYNC_INTERVAL = 10  # 差分同期の最小間隔（秒）
+POST_FULL_RELOAD_INTERVAL = 600  # 行の削除・編集を取り込むための全件再読み込み間隔（秒）
+_LAST_SHEET_COLUMN = gspread.utils.rowcol_to_a1(1, len(SHEET_COLUMNS))[:-1]
+
+def _normalize_sheet_row(values):
+    """シートの1行を列定義の長さに揃える（末尾の空セルは省略されて返るため）"""
+    row = [str(value) for value in values[:len(SHEET_COLUMNS)]]
+    return row + [""] * (len(SHEET_COLUMNS) - len(row))
+
+def prepare_posts(df):
+    """シートから読み込んだ投稿に型変換と派生列を適用する（取り込み時に1回だけ実行）"""
+    df['submission_date'] = pd.to_datetime(df['submission_date'], errors='coerce')
+    df['reason_bits'] = compute_reason_bits(df)
+    return sort_posts_by_time(df)
+
+def _first_dated_position(dates):
+    """日時不明（NaT）の行は先頭に並べているので、その直後の位置を二分探索で求める"""
+    lo, hi = 0, len(dates)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if np.isnat(dates[mid]):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _is_sorted_by_time(dates):
+    """日時不明（NaT）の行が先頭にまとまり、残りが昇順に並んでいるか"""
+    first = _first_dated_position(dates)
+    dated = dates[first:]
+    return bool(np.isnat(dates[:first]).all() and not np.isnat(dated).any() and (dated[1:] >= dated[:-1]).all())
+
+def sort_posts_by_time(df):
+    """投稿を投稿日時の昇順に並べる（日時不明の行は先頭）"""
+    if _is_sorted_by_time(df['submission_date'].to_numpy()):
+        return df
+    return df.sort_values('submission_date', kind='stable', na_position='first').reset_index(drop=True)
+
+def filter_by_submission_period(df, start=None, end=None, sorted_by_time=False):
+    """投稿日時が start より後、end 以前の投稿を返す
+
+    投稿ストアのデータやその絞り込み結果のように日時順に並んでいる場合は、
+    sorted_by_time=True を渡すと二分探索で切り出す。それ以外は全行を比較する。
+    """
+    if df.empty:
+        return df
+
+    dates = df['submission_date']
+    if not sorted_by_time or not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+        mask = dates.notna()
+        if start is not None:
+            mask &= dates > start
+        if end is not None:
+            mask &= dates <= end
+        return df[mask]
+
+    values = dates.to_numpy()
+    first = _first_dated_position(values)
+    dated = values[first:]
+    lo = first + (np.searchsorted(dated, np.datetime64(start), side='right') if start is not None else 0)
+    hi = first + (np.searchsorted(dated, np.datetime64(end), side='right') if end is not None else len(dated))
+    return df.iloc[lo:hi]
+
+def filter_recent_posts(df, days, sorted_by_time=False):
+    """直近 days 日間の投稿を返す"""
+    return filter_by_submission_period(df, start=datetime.now() - timedelta(days=days), sorted_by_time=sorted_by_time)
+
+class PostStore:
+    """スプレッドシートの投稿データをプロセス内で共有し、追加分だけを同期するストア
+
+    初回は全件を読み込み、以降は既知の最終行から後ろだけを範囲取得する。
+    シートへの書き込み待ちの投稿も重ねて返すので、投稿直後から一覧に反映される。
+    返すDataFrameは全セッションで共有されるため、呼び出し側で直接変更しないこと。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sheet_df = prepare_posts(pd.DataFrame(columns=SHEET_COLUMNS))
+        self._pending_rows = {}  # id -> 書き込み待ちの行
+        self._df = self._sheet_df
+        self._row_count = 0  # ヘッダーを除く取り込み済みの行数
+        self._last_row = None  # 取り込み済みの最終行（差分取得時の整合性チェック用）
+        self._last_sync = 0.0
+        self._last_full_load = 0.0
+        self._stale = True
+        self._derived = {}  # 現在のリビジョンから作った派生データ
+        self._accumulated = {}  # name -> (差分更新する集計, 反映済みの投稿IDごとの行数)
+        self.revision = 0  # 行が増減するたびに進むデータリビジョン
+
+    def invalidate(self):
+        """次回アクセス時に差分同期を強制する"""
+        with self._lock:
+            self._stale = True
+
+    def snapshot(self):
+        """同期せずに現在保持しているデータを返す"""
+        return self._df
+
+    def sheet_ids(self):
+        """シートと同期して、書き込み済みの投稿IDを返す（書き込み待ちの行は含めない）
+
+        シートを読めなかったときは、何も書き込まれていないとはみなさず例外を送出する。
+        """
+        with self._lock:
+            if initialize_worksheet() is None:
+                raise RuntimeError("スプレッドシートに接続できません")
+            self._stale = True
+            self.get_dataframe()
+            return set(self._sheet_df['id'])
+
+    def derived(self, name, build):
+        """現在のデータから作る派生データを、リビジョンが変わるまで使い回す"""
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = build(self._df)
+            return self._derived[name]
+
+    def accumulated(self, name, build, update):
+        """投稿が増えた分だけ更新しながら保持する集計
+
+        前回から投稿が追加されただけならupdate(集計, 追加分)で更新し、
+        消えた投稿があるときと全件再読み込みの後はbuild(全件)で作り直す。
+        IDは行数で数えるので、空や重複したIDがあっても追加分を取り出せる。
+        """
+        with self._lock:
+            if name not in self._derived:
+                ids = self._df['id'].fillna("")
+                added = None
+                if name in self._accumulated:
+                    value, known_counts = self._accumulated[name]
+                    # 同じIDの何行目かが反映済みの行数以上なら追加分
+                    is_new = (ids.groupby(ids, sort=False).cumcount() >= ids.map(known_counts).fillna(0)).to_numpy()
+                    if len(ids) - int(is_new.sum()) == int(known_counts.sum()):
+                        added = self._df[is_new]
+                    else:
+                        print(f"投稿が減ったため集計 {name} を作り直します")
+                if added is None:
+                    value, known_counts = build(self._df), ids.value_counts()
+                elif not added.empty:
+                    value = update(value, added)
+                    known_counts = known_counts.add(added['id'].value_counts(), fill_value=0)
+                self._accumulated[name] = (value, known_counts)
+                self._derived[name] = value
+            return self._derived[name]
+
+    def add_pending_row(self, row_values):
+        """シート未反映の投稿を一覧に加える"""
+        with self._lock:
+            self._pending_rows[row_values[0]] = row_values
+            self._publish()
+
+    def discard_pending_row(self, row_id):
+        """書き込みキューに積めなかった投稿を一覧から外す"""
+        with self._lock:
+            if self._pending_rows.pop(row_id, None) is not None:
+                self._publish()
+
+    def get_dataframe(self):
+        """必要に応じて同期してから投稿データを返す"""
+        with self._lock:
+            now = time.time()
+            if not self._stale and now - self._last_sync < POST_SYNC_INTERVAL:
+                return self._df
+            try:
+                if not self._last_full_load or now - self._last_full_load > POST_FULL_RELOAD_INTERVAL:
+                    retry_on_quota_error(self._full_load)
+                else:
+                    retry_on_quota_error(self._sync_new_rows)
+            finally:
+                # 失敗時も同じリラン内で再試行が連続しないよう同期時刻を進める
+                self._last_sync = now
+                self._stale = False
+            return self._df
+
+    def _full_load(self):
+        worksheet = initialize_worksheet()
+        if worksheet is None:
+            return
+
+        all_values = worksheet.get_all_values()
+
+        if all_values and all_values[0] != SHEET_COLUMNS:
+            print(f"ヘッダー行を修正します: {all_values[0]} -> {SHEET_COLUMNS}")
+            worksheet.update('A1', [SHEET_COLUMNS])
+            all_values = worksheet.get_all_values()
+
+        rows = [_normalize_sheet_row(values) for values in all_values[1:]]
+        self._sheet_df = prepare_posts(pd.DataFrame(rows, columns=SHEET_COLUMNS))
+        self._row_count = len(rows)
+        self._last_row = rows[-1] if rows else None
+        self._last_full_load = time.time()
+        self._drop_written_pending_rows(rows)
+        # 編集された行はIDが変わらず差分では検出できないので、差分更新の集計は作り直す
+        self._accumulated = {}
+        self._publish()
+
+    def _sync_new_rows(self):
+        worksheet = initialize_worksheet()
+        if worksheet is None:
+            return
+
+        # 既知の最終行から読み直し、シート側で行が消えていないか確認する
+        # （最終行ちょうどで終わるシートでも範囲がグリッド外にならない）
+        start_row = self._row_count + 1
+        values = worksheet.get(f"A{start_row}:{_LAST_SHEET_COLUMN}")
+        rows = [_normalize_sheet_row(row) for row in values]
+
+        anchor = self._last_row if self._row_count else SHEET_COLUMNS
+        if not rows or rows[0] != anchor:
+            print("スプレッドシートの既存行が変更されたため全件を再読み込みします")
+            self._full_load()
+            return
+
+        new_rows = rows[1:]
+        if new_rows:
+            new_df = prepare_posts(pd.DataFrame(new_rows, columns=SHEET_COLUMNS))
+            self._sheet_df = sort_posts_by_time(pd.concat([self._sheet_df, new_df], ignore_index=True))
+            self._row_count += len(new_rows)
+            self._last_row = new_rows[-1]
+            self._drop_written_pending_rows(new_rows)
+            self._publish()
+
+    def _drop_written_pending_rows(self, rows):
+        if self._pending_rows:
+            for row in rows:
+                self._pending_rows.pop(row[0], None)
+
+    def _publish(self):
+        if self._pending_rows:
+            pending_df = prepare_posts(pd.DataFrame(list(self._pending_rows.values()), columns=SHEET_COLUMNS))
+            self._df = sort_posts_by_time(pd.concat([self._sheet_df, pending_df], ignore_index=True))
+        else:
+            self._df = self._sheet_df
+        self._derived = {}
+        self.revision += 1
+
+@st.cache_resource
+def get_post_store():
+    """プロセス全体で共有する投稿ストアを取得"""
+    return PostStore()
+
+# データ読み込み・保存関連の関数
 def load_data():
-    """スプレッドシートからデータを読み込む"""
+    """投稿ストアからデータを読み込む（必要な分だけスプレッドシートと同期）"""
+    store = get_post_store()
     try:
-        def _load_data_inner():
-            worksheet = initialize_worksheet()
-            if worksheet is None:
-                return pd.DataFrame(columns=SHEET_COLUMNS)
-            
-            all_values = worksheet.get_all_values()
-            
-            if not all_values or len(all_values) < 1:
-                return pd.DataFrame(columns=SHEET_COLUMNS)
-            
-            header_row = all_values[0]
-            
-            if header_row != SHEET_COLUMNS:
-                print(f"ヘッダー行を修正します: {header_row} -> {SHEET_COLUMNS}")
-                worksheet.update('A1', [SHEET_COLUMNS])
-                all_values = worksheet.get_all_values()
-                header_row = all_values[0]
-            
-            if len(all_values) == 1:
-                return pd.DataFrame(columns=SHEET_COLUMNS)
-            
-            df = pd.DataFrame(all_values[1:], columns=header_row)
-            
-            for col in SHEET_COLUMNS:
-                if col not in df.columns:
-                    df[col] = ""
-            
-            df = df[SHEET_COLUMNS]
-            return df
-        
-        return retry_on_quota_error(_load_data_inner)
-        
+        return store.get_dataframe()
     except Exception as e:
         print(f"データ読み込みエラー: {e}")
         if "429" in str(e) or "Quota exceeded" in str(e):
             st.warning("⚠️ Google Sheets APIの制限に達しました。しばらく待ってから再度お試しください。")
         else:
             st.error(f"データ読み込みエラー: {e}")
-        return pd.DataFrame(columns=SHEET_COLUMNS)
+        return store.snapshot()
+
+def get_data_revision():
+    """投稿データのリビジョンを取得（集計キャッシュのキーに使う）"""
+    load_data()
+    return get_post_store().revision
+
+# 投稿の書き込みキュー設定
+LOCAL_DATA_DIR = "local_data"
+SUBMISSION_JOURNAL_FILE = os.path.join(LOCAL_DATA_DIR, "submission_journal.jsonl")
+SUBMISSION_FLUSH_INTERVAL = 2  # 連続した投稿をまとめるための待ち時間（秒）
+SUBMISSION_RETRY_INTERVAL = 30  # シート書き込み失敗時の再試行間隔（秒）
+
+class SubmissionQueue:
+    """投稿をローカルのジャーナルに記録し、バックグラウンドでまとめてシートに書き込むキュー
+
+    ジャーナルは追記専用のJSON Linesで、行の記録（row）と書き込み完了（ack）を残す。
+    起動時に未完了の行を読み戻して再送する。
+    """
+
+    def __init__(self, journal_path=SUBMISSION_JOURNAL_FILE):
+        self._journal_path = journal_path
+        self._lock = threading.Lock()
+        self._pending = []
+        self._maybe_written = False  # 前回の書き込みが例外で終わり、シートに反映済みかもしれない
+        self._wakeup = threading.Event()
+        self._replay_journal()
+        self._thread = threading.Thread(target=self._run, name="submission-flusher", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, row_values):
+        """投稿をジャーナルに書いてからキューに積む"""
+        with self._lock:
+            self._append_journal({"op": "row", "row": row_values})
+            self._pending.append(row_values)
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """溜まっている投稿を1回のAPI呼び出しでシートに書き込む"""
+        with self._lock:
+            batch = list(self._pending)
+        if not batch:
+            return True
+
+        if self._maybe_written:
+            # 書き込み自体は成功して応答だけ失敗した場合に、同じ行を二重に書かない
+            try:
+                written_ids = get_post_store().sheet_ids()
+            except Exception as e:
+                print(f"書き込み済みの投稿を確認できませんでした（後で再試行します）: {e}")
+                return False
+            self._maybe_written = False
+            written = [row for row in batch if row[0] in written_ids]
+            if written:
+                print(f"書き込み済みだった投稿{len(written)}件は再送しません")
+                self._acknowledge(written)
+                batch = [row for row in batch if row[0] not in written_ids]
+                if not batch:
+                    return True
+
+        try:
+            def _append_rows_inner():
+                worksheet = initialize_worksheet()
+                if worksheet is None:
+                    return False
+                worksheet.append_rows(batch)
+                return True
+
+            if not retry_on_quota_error(_append_rows_inner):
+                return False
+        except Exception as e:
+            print(f"スプレッドシート書き込みエラー（{len(batch)}件は後で再送します）: {e}")
+            self._maybe_written = True
+            return False
+
+        self._acknowledge(batch)
+        get_post_store().invalidate()
+        return True
+
+    def _acknowledge(self, rows):
+        """書き込み済みの行をキューから外し、ジャーナルに記録する"""
+        ids = {row[0] for row in rows}
+        with self._lock:
+            self._pending = [row for row in self._pending if row[0] not in ids]
+            self._append_journal({"op": "ack", "ids": [row[0] for row in rows]})
+            if not self._pending:
+                # すべて書き込めたらジャーナルを空にする
+                open(self._journal_path, "w", encoding="utf-8").close()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(SUBMISSION_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            if not self.flush():
+                time.sleep(SUBMISSION_RETRY_INTERVAL)
+                self._wakeup.set()
+
+    def _append_journal(self, record):
+        os.makedirs(os.path.dirname(self._journal_path) or ".", exist_ok=True)
+        with open(self._journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay_journal(self):
+        if not os.path.exists(self._journal_path):
+            return
+
+        rows = {}
+        with open(self._journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 書き込み途中で終了した行
+                if record.get("op") == "row":
+                    rows[record["row"][0]] = record["row"]
+                elif record.get("op") == "ack":
+                    for row_id in record.get("ids", []):
+                        rows.pop(row_id, None)
+
+        if rows:
+            # 書き込み直後に終了してackだけ残らなかった行もあり得るので、
+            # 送る前に必ずシートと照合する（起動時に読み込めなくても未書き込みとはみなさない）
+            self._pending = list(rows.values())
+            self._maybe_written = True
+            print(f"未書き込みの可能性がある投稿{len(self._pending)}件をシートと照合してから再送します")
+            shown_ids = set(load_data()['id'])
+            for row in self._pending:
+                if row[0] not in shown_ids:
+                    get_post_store().add_pending_row(row)
+            self._wakeup.set()
+        else:
+            open(self._journal_path, "w", encoding="utf-8").close()
+
+@st.cache_resource
+def get_submission_queue():
+    """プロセス全体で共有する書き込みキューを取得
+
+    ジャーナルはプロセス間で排他しないので、投稿を受け付けるユーザーアプリだけが使う。
+    """
+    return SubmissionQueue()
 
 def append_row_to_sheet(row_data):
-    """スプレッドシートに新しい行を追加"""
+    """新しい行を書き込みキューに追加（シートへはバックグラウンドでまとめて書き込む）"""
     try:
-        def _append_row_inner():
-            worksheet = initialize_worksheet()
-            if worksheet is None:
-                return False
-            
-            row_values = []
-            for col in SHEET_COLUMNS:
-                value = row_data.get(col, "")
-                if value is None:
-                    value = ""
-                row_values.append(str(value))
-            
-            worksheet.append_row(row_values)
-            return True
-        
-        success = retry_on_quota_error(_append_row_inner)
+        row_values = []
+        for col in SHEET_COLUMNS:
+            value = row_data.get(col, "")
+            if value is None:
+                value = ""
+            row_values.append(str(value))
         
-        if success:
-            st.cache_data.clear()
+        # 書き込みが先に終わっても一覧から消えたり二重になったりしないよう、一覧に加えてから積む
+        store = get_post_store()
+        store.add_pending_row(row_values)
+        try:
+            get_submission_queue().enqueue(row_values)
+        except Exception:
+            store.discard_pending_row(row_values[0])
+            raise
         
-        return success
+        return True
         
     except Exception as e:
-        print(f"スプレッドシート書き込みエラー: {e}")
-        if "429" in str(e) or "Quota exceeded" in str(e):
-            st.warning("⚠️ Google Sheets APIの制限に達しました。しばらく待ってから再度お試しください。")
-        else:
-            st.error(f"スプレッドシート書き込みエラー: {e}")
+        print(f"投稿保存エラー: {e}")
+        st.error(f"投稿保存エラー: {e}")
         return False
 
+# 投稿数の集計キューブ
+ONLINE_PREFECTURE = 'オンライン・Web開催'
+CUBE_POST_DIMENSIONS = ['prefecture', 'municipality', 'day']
+CUBE_REASON_DIMENSIONS = ['prefecture', 'municipality', 'reason', 'day']
+
+def _cube_keys(df):
+    """投稿ごとの (開催都道府県, 市区町村, 投稿日) キー（市区町村不明は空文字）"""
+    return pd.DataFrame({
+        'prefecture': df['event_prefecture'].fillna(""),
+        'municipality': df['event_municipality'].fillna("").replace("選択なし", ""),
+        'day': pd.to_datetime(df['submission_date'], errors='coerce').dt.normalize()
+    }, index=df.index)
+
+def _sum_cells(table, dimensions):
+    """同じセルの件数を合算する（投稿日不明のセルも残す）"""
+    return table.groupby(dimensions, dropna=False, sort=False)['count'].sum().reset_index()
+
+class CountCube:
+    """(開催都道府県, 市区町村, 理由, 投稿日) 単位の件数を持つ集計キューブ
+
+    1投稿が複数の理由を持つため、投稿数は理由を除いた (都道府県, 市区町村, 投稿日) 単位で別に持つ。
+    イベント数を数えるためにイベント名ごとの投稿数も持つ。
+    追加された投稿はその分だけ集計して足し合わせるので、集計の手間は投稿総数によらない。
+    シートの行が編集されても差分では分からないため、全件再読み込みの後は作り直す。
+    """
+    
+    def __init__(self, posts, reasons, events):
+        self.posts = posts  # CUBE_POST_DIMENSIONS + count
+        self.reasons = reasons  # CUBE_REASON_DIMENSIONS + count
+        self.events = events  # イベント名 -> 投稿数
+    
+    @classmethod
+    def from_posts(cls, df):
+        """投稿を集計してキューブを作成"""
+        keys = _cube_keys(df)
+        posts = _sum_cells(keys.assign(count=1), CUBE_POST_DIMENSIONS)
+        
+        exploded = explode_reasons(df)
+        reason_keys = keys.loc[exploded['post']].reset_index(drop=True)
+        reason_keys['reason'] = exploded['reason'].astype(str).to_numpy()
+        reasons = _sum_cells(reason_keys.assign(count=1), CUBE_REASON_DIMENSIONS)
+        
+        events = df['event_name'].value_counts() if 'event_name' in df.columns else pd.Series(dtype=int)
+        return cls(posts, reasons, events)
+    
+    def add_posts(self, df):
+        """追加された投稿の分を足し合わせた新しいキューブを返す"""
+        delta = CountCube.from_posts(df)
+        return CountCube(
+            _sum_cells(pd.concat([self.posts, delta.posts], ignore_index=True), CUBE_POST_DIMENSIONS),
+            _sum_cells(pd.concat([self.reasons, delta.reasons], ignore_index=True), CUBE_REASON_DIMENSIONS),
+            self.events.add(delta.events, fill_value=0).astype(int)
+        )
+    
+    @staticmethod
+    def _slice(table, prefecture=None, municipality=None, online=None):
+        """条件に合うセルを切り出す（online=Falseでオンライン開催を除く、Trueでオンライン開催のみ）"""
+        mask = np.ones(len(table), dtype=bool)
+        if prefecture is not None:
+            mask &= (table['prefecture'] == prefecture).to_numpy()
+        if municipality is not None:
+            mask &= (table['municipality'] == municipality).to_numpy()
+        if online is not None:
+            mask &= (table['prefecture'] == ONLINE_PREFECTURE).to_numpy() == online
+        return table[mask]
+    
+    @staticmethod
+    def _sum(table, by):
+        if by is None:
+            return int(table['count'].sum())
+        counts = table.groupby(by, sort=False)['count'].sum()
+        return counts[counts > 0].sort_values(ascending=False, kind='stable')
+    
+    def count_posts(self, by=None, **filters):
+        """投稿数の合計（byを指定するとその次元ごとの件数を多い順に返す）"""
+        return self._sum(self._slice(self.posts, **filters), by)
+    
+    def count_reasons(self, **filters):
+        """理由ごとの件数を多い順に返す（index: 理由, 値: 件数）"""
+        return self._sum(self._slice(self.reasons, **filters), 'reason')
+    
+    def count_events(self):
+        """投稿のあるイベントの数"""
+        return int((self.events > 0).sum())
+
+def get_count_cube():
+    """全投稿の集計キューブを取得（新しい投稿の分だけ差分で更新し、全件再読み込みの後は作り直す）"""
+    load_data()
+    return get_post_store().accumulated(
+        'count_cube', CountCube.from_posts, lambda cube, added: cube.add_posts(added)
+    )
+
 # 新しい関数：地域別データ集計
 
 def count_by_prefecture():
     """都道府県別の投稿数を集計"""
-    df = load_data()
-    if df.empty:
-        return pd.DataFrame(columns=["prefecture", "count", "latitude", "longitude"])
-    
+    return _count_by_prefecture(get_data_revision())
+
+@st.cache_data(max_entries=4)
+def _count_by_prefecture(revision):
     # Web開催を除く
-    regional_df = df[df['event_prefecture'] != 'オンライン・Web開催']
+    prefecture_counts = get_count_cube().count_posts('prefecture', online=False)
     
-    if regional_df.empty:
+    if prefecture_counts.empty:
         return pd.DataFrame(columns=["prefecture", "count", "latitude", "longitude"])
     
-    counts = regional_df['event_prefecture'].value_counts().reset_index()
+    counts = prefecture_counts.reset_index()
     counts.columns = ["prefecture", "count"]
     
     # 座標を追加
@@ -353,43 +1000,32 @@ def count_by_prefecture():
 
 def count_by_municipality_in_prefecture(prefecture):
     """特定都道府県内の市区町村別投稿数を集計"""
-    df = load_data()
-    if df.empty:
-        return pd.DataFrame(columns=["municipality", "count", "latitude", "longitude", "prefecture"])
-    
-    # 指定都道府県のデータのみ
-    pref_df = df[df['event_prefecture'] == prefecture]
+    return _count_by_municipality_in_prefecture(get_data_revision(), prefecture)
+
+@st.cache_data(max_entries=100)
+def _count_by_municipality_in_prefecture(revision, prefecture):
+    # 指定都道府県の市区町村別の集計
+    municipal_counts = get_count_cube().count_posts('municipality', prefecture=prefecture)
     
-    if pref_df.empty:
+    if municipal_counts.empty:
         return pd.DataFrame(columns=["municipality", "count", "latitude", "longitude", "prefecture"])
     
-    # 市区町村別の集計
-    municipal_counts = defaultdict(int)
-    coordinates = {}
+    # 座標を追加（市区町村ごとに1回だけ引く）
+    result_data = []
+    gazetteer = get_city_gazetteer()
     
-    for _, row in pref_df.iterrows():
-        municipality = row.get('event_municipality', '')
-        
-        if not municipality or municipality == "選択なし":
+    for municipality, count in municipal_counts.items():
+        if not municipality:
             # 市区町村不明の場合は県庁所在地
-            key = f"{prefecture}（詳細不明）"
-            municipal_counts[key] += 1
-            if prefecture in PREFECTURE_LOCATIONS:
-                coordinates[key] = PREFECTURE_LOCATIONS[prefecture]
+            municipality = f"{prefecture}（詳細不明）"
+            lat, lon = PREFECTURE_LOCATIONS.get(prefecture, (None, None))
         else:
-            municipal_counts[municipality] += 1
-            lat, lon = get_municipality_coordinates(prefecture, municipality)
-            if lat is not None and lon is not None:
-                coordinates[municipality] = (lat, lon)
-    
-    # DataFrame作成
-    result_data = []
-    for municipality, count in municipal_counts.items():
-        if municipality in coordinates:
-            lat, lon = coordinates[municipality]
+            lat, lon = gazetteer.get_coordinates(prefecture, municipality)
+        
+        if lat is not None and lon is not None:
             result_data.append({
                 "municipality": municipality,
-                "count": count,
+                "count": int(count),
                 "latitude": lat,
                 "longitude": lon,
                 "prefecture": prefecture  # 追加：都道府県情報
@@ -429,53 +1065,307 @@ def get_online_posts():
     
     return df[df['event_prefecture'] == 'オンライン・Web開催']
 
-def count_by_reason():
-    """理由別の集計を行う関数"""
-    df = load_data()
+# 全国クラスタマップ
+CLUSTER_ZOOM_LEVELS = [4, 5, 6, 7, 8, 9, 10]
+CLUSTER_CELL_PIXELS = 64  # 画面上でこの大きさ（ピクセル）のマス目ごとに地点をまとめる
+
+def geocode_post_locations(df):
+    """地域開催の投稿を地点（都道府県・市区町村）ごとに数え、座標を付ける
+
+    市区町村が不明・座標なしの投稿は県庁所在地にまとめる。
+    """
+    columns = ["prefecture", "municipality", "label", "count", "latitude", "longitude"]
     if df.empty:
-        return pd.DataFrame(columns=["理由", "件数"])
+        return pd.DataFrame(columns=columns)
     
-    reasons_count = {}
-    for idx, row in df.iterrows():
-        if pd.isna(row["reasons"]) or row["reasons"] == "":
-            continue
-        reasons_list = str(row["reasons"]).split("|")
-        for reason in reasons_list:
-            if reason in reasons_count:
-                reasons_count[reason] += 1
-            else:
-                reasons_count[reason] = 1
+    regional_df = df[df['event_prefecture'] != 'オンライン・Web開催']
+    municipalities = regional_df['event_municipality'].fillna("").replace("選択なし", "")
+    counts = pd.DataFrame({
+        'prefecture': regional_df['event_prefecture'],
+        'municipality': municipalities
+    }).value_counts(sort=False).reset_index(name='count')
     
-    reasons_df = pd.DataFrame({
-        "理由": list(reasons_count.keys()),
-        "件数": list(reasons_count.values())
-    }).sort_values("件数", ascending=False)
+    gazetteer = get_city_gazetteer()
+    rows = []
+    for prefecture, municipality, count in counts.itertuples(index=False):
+        lat, lon = gazetteer.get_coordinates(prefecture, municipality) if municipality else (None, None)
+        label = f"{prefecture} {municipality}" if municipality else prefecture
+        if lat is None or lon is None:
+            if prefecture not in PREFECTURE_LOCATIONS:
+                continue
+            lat, lon = PREFECTURE_LOCATIONS[prefecture]
+            municipality, label = "", prefecture
+        rows.append((prefecture, municipality, label, count, lat, lon))
     
-    return reasons_df
+    # 県庁所在地にまとめたものは同じ地点として合算する
+    locations = pd.DataFrame(rows, columns=columns)
+    return locations.groupby(["prefecture", "municipality", "label"], as_index=False, sort=False).agg(
+        count=("count", "sum"), latitude=("latitude", "first"), longitude=("longitude", "first")
+    )
 
-def get_basic_statistics():
-    """基本統計情報を取得"""
-    df = load_data()
+class ClusterIndex:
+    """地点をズームレベルごとのマス目でまとめた、クラスタのピラミッド
+
+    全レベルを構築時に計算しておき、描画時は表を引くだけにする。
+    """
     
-    if df.empty:
-        return {
-            'total_posts': 0,
-            'unique_events': 0,
-            'prefectures': 0,
-            'online_posts': 0,
-            'recent_posts': 0
+    def __init__(self, locations, zoom_levels=CLUSTER_ZOOM_LEVELS, cell_pixels=CLUSTER_CELL_PIXELS):
+        self.zoom_levels = sorted(zoom_levels)
+        self.levels = {
+            zoom: self._cluster(locations, self.cell_size(zoom, cell_pixels))
+            for zoom in self.zoom_levels
         }
     
-    total_posts = len(df)
-    unique_events = df['event_name'].nunique()
-    prefectures = len(df[df['event_prefecture'] != 'オンライン・Web開催']['event_prefecture'].unique())
-    online_posts = len(df[df['event_prefecture'] == 'オンライン・Web開催'])
+    @staticmethod
+    def cell_size(zoom, cell_pixels=CLUSTER_CELL_PIXELS):
+        """ズームレベルでのマス目の大きさ（度）"""
+        return cell_pixels * 360.0 / (256 * 2 ** zoom)
+    
+    @staticmethod
+    def _cluster(locations, cell):
+        columns = ["label", "count", "locations", "latitude", "longitude"]
+        if locations.empty:
+            return pd.DataFrame(columns=columns)
+        
+        lat = locations['latitude'].to_numpy(dtype=float)
+        lon = locations['longitude'].to_numpy(dtype=float)
+        weights = locations['count'].to_numpy(dtype=float)
+        
+        # 同じマス目の地点を1つのクラスタにする
+        cells = np.column_stack([np.floor(lon / cell), np.floor(lat / cell)])
+        _, cluster_ids = np.unique(cells, axis=0, return_inverse=True)
+        cluster_ids = cluster_ids.ravel()
+        totals = np.bincount(cluster_ids, weights=weights)
+        
+        # クラスタ名は投稿が最も多い地点
+        order = np.lexsort((-weights, cluster_ids))
+        sorted_ids = cluster_ids[order]
+        heaviest = order[np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]]
+        
+        clusters = pd.DataFrame({
+            'label': locations['label'].to_numpy()[heaviest],
+            'count': totals.astype(int),
+            'locations': np.bincount(cluster_ids),
+            # 投稿数で重み付けした重心
+            'latitude': np.bincount(cluster_ids, weights=weights * lat) / totals,
+            'longitude': np.bincount(cluster_ids, weights=weights * lon) / totals,
+        })
+        return clusters.sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+    
+    def clusters(self, zoom):
+        """ズームレベルに最も近いレベルのクラスタ一覧"""
+        nearest = min(self.zoom_levels, key=lambda level: abs(level - zoom))
+        return self.levels[nearest]
+
+def get_cluster_index():
+    """全投稿のクラスタインデックスを取得（データリビジョンごとに1回だけ構築）"""
+    load_data()
+    return get_post_store().derived(
+        'cluster_index', lambda df: ClusterIndex(geocode_post_locations(df))
+    )
+
+# 全国ヒートマップ
+DENSITY_BOUNDS = (24.0, 46.0, 122.0, 146.0)  # 南端・北端・西端・東端（度）
+DENSITY_CELL_DEGREES = 0.1  # ラスターのマスの大きさ（約10km）
+DENSITY_SIGMA_CELLS = 1.5  # ぼかしの標準偏差（マス数）
+DENSITY_MIN_RATIO = 0.05  # 最大値に対してこれ未満の密度のマスは送らない
+
+def _gaussian_kernel(sigma):
+    """合計が1になる1次元ガウスカーネル（半径は3σ）"""
+    radius = max(1, int(np.ceil(3 * sigma)))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    return kernel / kernel.sum()
+
+class DensityGrid:
+    """固定の緯度経度ラスターに投稿数を集計し、ガウスぼかしをかけた密度面
+
+    ぼかしは線形なので、新しい投稿はそのマスにカーネルを足し込むだけで反映できる。
+    """
+    
+    def __init__(self, bounds=DENSITY_BOUNDS, cell=DENSITY_CELL_DEGREES, sigma=DENSITY_SIGMA_CELLS):
+        self.south, self.north, self.west, self.east = bounds
+        self.cell = cell
+        self.shape = (int(round((self.north - self.south) / cell)), int(round((self.east - self.west) / cell)))
+        self.kernel = _gaussian_kernel(sigma)
+        self.counts = np.zeros(self.shape)
+        self.density = np.zeros(self.shape)
+    
+    @classmethod
+    def from_posts(cls, df):
+        """全投稿からラスターを作成（ぼかしは縦横に分けて一括でかける）"""
+        grid = cls()
+        rows, cols, counts = grid._cell_counts(df)
+        np.add.at(grid.counts, (rows, cols), counts)
+        grid.density = grid._blur(grid._blur(grid.counts, axis=0), axis=1)
+        return grid
+    
+    def add_posts(self, df):
+        """追加された投稿の分だけ件数と密度を更新"""
+        rows, cols, counts = self._cell_counts(df)
+        radius = len(self.kernel) // 2
+        stamp = np.outer(self.kernel, self.kernel)
+        
+        # 読み出し中の配列を書き換えないよう、複製に反映してから差し替える
+        new_counts = self.counts.copy()
+        new_density = self.density.copy()
+        np.add.at(new_counts, (rows, cols), counts)
+        for row, col, count in zip(rows, cols, counts):
+            top, bottom = max(row - radius, 0), min(row + radius + 1, self.shape[0])
+            left, right = max(col - radius, 0), min(col + radius + 1, self.shape[1])
+            new_density[top:bottom, left:right] += count * stamp[
+                top - row + radius:bottom - row + radius,
+                left - col + radius:right - col + radius
+            ]
+        self.counts, self.density = new_counts, new_density
+        return self
+    
+    def _cell_counts(self, df):
+        """投稿を地点ごとにまとめてマスに割り当て、(行, 列, 件数) を返す"""
+        locations = geocode_post_locations(df)
+        lat = locations['latitude'].to_numpy(dtype=float)
+        lon = locations['longitude'].to_numpy(dtype=float)
+        rows = np.floor((lat - self.south) / self.cell).astype(int)
+        cols = np.floor((lon - self.west) / self.cell).astype(int)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        return rows[inside], cols[inside], locations['count'].to_numpy(dtype=float)[inside]
+    
+    def _blur(self, values, axis):
+        """1方向のガウスぼかし（ラスターの外は0とみなす）"""
+        radius = len(self.kernel) // 2
+        padding = [(0, 0), (0, 0)]
+        padding[axis] = (radius, radius)
+        padded = np.pad(values, padding)
+        blurred = np.zeros_like(values)
+        length = values.shape[axis]
+        for offset, weight in enumerate(self.kernel):
+            blurred += weight * np.take(padded, np.arange(offset, offset + length), axis=axis)
+        return blurred
+    
+    def cells(self, min_ratio=DENSITY_MIN_RATIO):
+        """密度が最大値のmin_ratio以上のマスを、中心の経度・緯度と0〜1の重みで返す"""
+        density = self.density
+        max_density = density.max()
+        if max_density <= 0:
+            return pd.DataFrame(columns=["longitude", "latitude", "weight"])
+        rows, cols = np.nonzero(density >= max_density * min_ratio)
+        return pd.DataFrame({
+            'longitude': self.west + (cols + 0.5) * self.cell,
+            'latitude': self.south + (rows + 0.5) * self.cell,
+            'weight': density[rows, cols] / max_density
+        })
+
+def get_density_grid():
+    """全投稿の密度ラスターを取得（新しい投稿の分だけ差分で更新し、全件再読み込みの後は作り直す）"""
+    load_data()
+    return get_post_store().accumulated(
+        'density_grid', DensityGrid.from_posts, lambda grid, added: grid.add_posts(added)
+    )
+
+# 理由の集計エンジン
+def explode_reasons(df):
+    """パイプ区切りのreasons列を (post, reason) の縦持ちテーブルに展開する
+
+    postは元のDataFrameのインデックス、reasonはカテゴリ型。
+    """
+    if df.empty or 'reasons' not in df.columns:
+        return pd.DataFrame({
+            'post': pd.Series(dtype=df.index.dtype),
+            'reason': pd.Categorical([])
+        })
+    
+    exploded = df['reasons'].dropna().astype(str).str.split('|').explode()
+    exploded = exploded[exploded != ""]
+    return pd.DataFrame({
+        'post': exploded.index,
+        'reason': pd.Categorical(exploded.to_numpy())
+    })
+
+def get_reason_table():
+    """全投稿の (post, reason) テーブルを取得（データリビジョンごとに1回だけ展開）"""
+    load_data()
+    return get_post_store().derived('reason_table', explode_reasons)
+
+def _reason_value_counts(reasons):
+    counts = reasons.value_counts()
+    return counts[counts > 0]
+
+def count_reasons(df):
+    """理由ごとの件数を多い順に返す（index: 理由, 値: 件数）"""
+    return _reason_value_counts(explode_reasons(df)['reason'])
+
+def compute_reason_bits(df):
+    """投稿ごとに、選択肢の理由をビットで表したuint32配列を作る"""
+    exploded = explode_reasons(df)
+    bit_index = exploded['reason'].map(REASON_BIT_INDEX)
+    known = exploded[bit_index.notna()].assign(
+        bit=np.left_shift(np.uint32(1), bit_index.dropna().astype(np.uint32).to_numpy())
+    ).drop_duplicates(['post', 'reason'])
+    bits = known.groupby('post')['bit'].sum()
+    return bits.reindex(df.index, fill_value=0).astype(np.uint32).to_numpy()
+
+def reason_mask(df, reasons, match_all=False):
+    """指定した理由を含む投稿の真偽マスクを返す
+
+    理由は「|」区切りの要素単位で完全一致を判定するので、他の理由の部分文字列でも誤検出しない。
+    match_all=True ならすべての理由を含む投稿、False ならいずれかを含む投稿。
+    """
+    reasons = [reasons] if isinstance(reasons, str) else list(reasons)
+    bits = df['reason_bits'].to_numpy() if 'reason_bits' in df.columns else compute_reason_bits(df)
+
+    known = [reason for reason in reasons if reason in REASON_BIT_INDEX]
+    wanted = np.uint32(sum(1 << REASON_BIT_INDEX[reason] for reason in set(known)))
+    if match_all:
+        mask = (bits & wanted) == wanted
+    else:
+        mask = (bits & wanted) != 0 if known else np.zeros(len(df), dtype=bool)
+
+    # 「その他: ...」などの自由記述は要素単位の文字列一致で判定する
+    free_text = [reason for reason in reasons if reason not in REASON_BIT_INDEX]
+    if free_text:
+        wrapped = "|" + df['reasons'].fillna("").astype(str) + "|"
+        for reason in free_text:
+            found = wrapped.str.contains(f"|{reason}|", regex=False).to_numpy()
+            mask = (mask & found) if match_all else (mask | found)
+
+    return pd.Series(mask, index=df.index)
+
+def filter_by_reasons(df, reasons, match_all=False):
+    """理由で投稿を絞り込む"""
+    if df.empty:
+        return df
+    return df[reason_mask(df, reasons, match_all)]
+
+def count_by_reason():
+    """理由別の集計を行う関数"""
+    return _count_by_reason(get_data_revision())
+
+@st.cache_data(max_entries=4)
+def _count_by_reason(revision):
+    reasons_count = get_count_cube().count_reasons()
+    if reasons_count.empty:
+        return pd.DataFrame(columns=["理由", "件数"])
+    
+    return pd.DataFrame({
+        "理由": reasons_count.index.astype(str),
+        "件数": reasons_count.to_numpy()
+    })
+
+def get_basic_statistics():
+    """基本統計情報を取得"""
+    return _get_basic_statistics(get_data_revision())
+
+@st.cache_data(ttl=600, max_entries=4)  # 「最近7日間」が古くならないよう時間でも失効させる
+def _get_basic_statistics(revision):
+    cube = get_count_cube()
+    
+    total_posts = cube.count_posts()
+    unique_events = cube.count_events()
+    prefectures = len(cube.count_posts('prefecture', online=False))
+    online_posts = cube.count_posts(online=True)
     
-    # 最近7日間の投稿数
-    df_temp = df.copy()
-    df_temp['submission_date'] = pd.to_datetime(df_temp['submission_date'], errors='coerce')
-    recent_cutoff = datetime.now() - pd.Timedelta(days=7)
-    recent_posts = len(df_temp[df_temp['submission_date'] > recent_cutoff])
+    # 最近7日間の投稿数（日時順に並んでいるので二分探索で数える。日単位のキューブでは端数が出る）
+    recent_posts = len(filter_recent_posts(get_post_store().snapshot(), 7, sorted_by_time=True))
     
     return {
         'total_posts': total_posts,
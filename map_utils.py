@@ -1,11 +1,124 @@
+import json
 import pydeck as pdk
 import pandas as pd
+import numpy as np
 import streamlit as st
 import logic
-import math
 
-def create_prefecture_map(prefecture_data, selected_prefecture=None):
-    """都道府県レベルのマップを作成"""
+# 色・半径の計算（全地点をNumPyでまとめて計算する）
+SELECTED_COLOR = [255, 165, 0, 255]  # オレンジ色（選択中）
+COLOR_COLUMNS = ['color_r', 'color_g', 'color_b', 'color_a']
+COLOR_ACCESSOR = "[color_r, color_g, color_b, color_a]"
+
+def _count_intensity(counts):
+    """投稿数を最大値で割った0〜1の配列と、最大値が正かどうか"""
+    values = counts.to_numpy(dtype=float)
+    max_count = values.max() if len(values) else 0
+    if max_count > 0:
+        return np.minimum(values / max_count, 1.0), True
+    return np.zeros(len(values)), False
+
+def _radius_pixels(intensity, min_radius, max_radius):
+    """平方根を使って視覚的にバランスの取れた半径（ピクセル単位）"""
+    return (min_radius + (max_radius - min_radius) * np.sqrt(intensity)).astype(int)
+
+def _apply_style(map_data, colors, selected_mask, radius):
+    """色（選択中は上書き）と半径の列を追加"""
+    colors[selected_mask] = SELECTED_COLOR
+    map_data[COLOR_COLUMNS] = colors
+    map_data['radius_pixels'] = radius
+    return map_data
+
+def style_prefecture_points(prefecture_data, selected_prefecture=None):
+    """都道府県の地点に色と半径を付ける"""
+    map_data = prefecture_data.copy()
+    intensity, has_posts = _count_intensity(map_data['count'])
+    
+    colors = np.empty((len(map_data), 4), dtype=int)
+    if has_posts:
+        # 薄い赤から濃い赤へのグラデーション（200-255の範囲）
+        colors[:] = [0, 89, 73, 220]
+        colors[:, 0] = 200 + (55 * intensity).astype(int)
+    else:
+        colors[:] = [253, 89, 73, 200]
+    
+    selected_mask = (map_data['prefecture'] == selected_prefecture).to_numpy()
+    return _apply_style(map_data, colors, selected_mask, _radius_pixels(intensity, 25, 100))
+
+def style_municipality_points(municipality_data, selected_municipality=None):
+    """市区町村の地点に色と半径を付ける"""
+    map_data = municipality_data.copy()
+    intensity, has_posts = _count_intensity(map_data['count'])
+    
+    colors = np.empty((len(map_data), 4), dtype=int)
+    if has_posts:
+        # 薄い紫から濃い紫へのグラデーション
+        colors[:, 0] = np.minimum(67 + (100 * intensity).astype(int), 167)
+        colors[:, 1] = np.minimum(56 + (50 * intensity).astype(int), 106)
+        colors[:, 2] = np.minimum(202 + (53 * intensity).astype(int), 255)
+        colors[:, 3] = 220
+    else:
+        colors[:] = [67, 56, 202, 200]
+    
+    selected_mask = (map_data['municipality'] == selected_municipality).to_numpy()
+    return _apply_style(map_data, colors, selected_mask, _radius_pixels(intensity, 20, 70))
+
+def style_cluster_points(cluster_data):
+    """全国クラスタに色と半径を付ける"""
+    map_data = cluster_data.copy()
+    intensity, has_posts = _count_intensity(map_data['count'])
+    
+    colors = np.empty((len(map_data), 4), dtype=int)
+    if has_posts:
+        # 薄い青緑から濃い青緑へのグラデーション
+        colors[:, 0] = 13
+        colors[:, 1] = np.minimum(148 + (40 * intensity).astype(int), 188)
+        colors[:, 2] = np.minimum(136 + (30 * intensity).astype(int), 166)
+        colors[:, 3] = 220
+    else:
+        colors[:] = [13, 148, 136, 200]
+    
+    selected_mask = np.zeros(len(map_data), dtype=bool)
+    return _apply_style(map_data, colors, selected_mask, _radius_pixels(intensity, 15, 60))
+
+# ブラウザに送る地図データの設定
+COORDINATE_DECIMALS = 5  # 約1mの精度
+MAP_PAYLOAD_BUDGET_BYTES = 256 * 1024  # 1回の描画で送る地図JSONの目安
+
+def build_layer_payloads(map_data, label_column, extra_columns=()):
+    """レイヤーとツールチップが使う列だけに絞ったデータを作る
+
+    pydeckはレイヤー間でデータを共有できないため、数字レイヤーには位置と件数だけを渡す。
+    (円レイヤー用, 数字レイヤー用) を返す。
+    """
+    points = map_data[[label_column, 'count', *extra_columns, 'longitude', 'latitude', *COLOR_COLUMNS, 'radius_pixels']].copy()
+    points[['longitude', 'latitude']] = points[['longitude', 'latitude']].astype(float).round(COORDINATE_DECIMALS)
+    labels = points[['longitude', 'latitude', 'count']]
+    return points, labels
+
+def build_heatmap_payload(density_cells):
+    """密度ラスターのマスを、ヒートマップに必要な精度に丸めたデータにする"""
+    cells = density_cells[['longitude', 'latitude', 'weight']].astype(float)
+    cells[['longitude', 'latitude']] = cells[['longitude', 'latitude']].round(2)
+    cells['weight'] = cells['weight'].round(3)
+    return cells
+
+class SerializedDeck(pdk.Deck):
+    """コンパクトなJSONにして結果を覚えておくDeck（同じ地図の再描画でシリアライズし直さない）"""
+    _serialized = None
+    payload_bytes = None
+    
+    def to_json(self):
+        if self._serialized is None:
+            # pydeckの出力はインデント付き・日本語エスケープありなので詰め直す
+            self._serialized = json.dumps(json.loads(super().to_json()), ensure_ascii=False, separators=(',', ':'))
+            self.payload_bytes = len(self._serialized.encode('utf-8'))
+            if self.payload_bytes > MAP_PAYLOAD_BUDGET_BYTES:
+                print(f"地図データが目安を超えています: {self.payload_bytes:,}バイト（目安 {MAP_PAYLOAD_BUDGET_BYTES:,}バイト）")
+        return self._serialized
+
+def create_prefecture_map(prefecture_data, selected_prefecture=None, density_cells=None):
+    """都道府県レベルのマップを作成（density_cellsを渡すと密度のヒートマップを重ねる）"""
     if prefecture_data.empty:
         return None
     
@@ -32,51 +145,35 @@ def create_prefecture_map(prefecture_data, selected_prefecture=None):
     )
     
     # データに色と適切な半径を追加
-    map_data = prefecture_data.copy()
-    
-    def get_color(pref, count, max_count):
-        if pref == selected_prefecture:
-            return [255, 165, 0, 255]  # オレンジ色（選択中）
-        else:
-            # 投稿数に応じて色の濃さを調整
-            if max_count > 0:
-                intensity = min(count / max_count, 1.0)
-                # 薄い赤から濃い赤へのグラデーション
-                base_color = 200 + int(55 * intensity)  # 200-255の範囲
-                return [base_color, 89, 73, 220]
-            else:
-                return [253, 89, 73, 200]
-    
-    def calculate_radius(count, max_count):
-        """投稿数に基づいて適切な半径を計算（ピクセル単位）"""
-        min_radius = 25
-        max_radius = 100
-        
-        if max_count > 0:
-            normalized = count / max_count
-        else:
-            normalized = 0
-        
-        # 平方根を使って視覚的にバランスの取れたサイズ調整
-        radius = min_radius + (max_radius - min_radius) * math.sqrt(normalized)
-        return int(radius)
-    
-    # 最大投稿数を取得
-    max_count = map_data['count'].max()
-    
-    map_data['color'] = map_data.apply(lambda row: get_color(row['prefecture'], row['count'], max_count), axis=1)
-    map_data['radius_pixels'] = map_data['count'].apply(lambda x: calculate_radius(x, max_count))
+    map_data = style_prefecture_points(prefecture_data, selected_prefecture)
+    points, labels = build_layer_payloads(map_data, 'prefecture')
     
     # レイヤーリスト
     layers = []
     
+    # 密度のヒートマップ（円の下に描く）
+    if density_cells is not None and not density_cells.empty:
+        heatmap_layer = pdk.Layer(
+            "HeatmapLayer",
+            id="density_layer",
+            data=build_heatmap_payload(density_cells),
+            get_position=["longitude", "latitude"],
+            get_weight="weight",
+            radius_pixels=30,
+            intensity=1,
+            threshold=0.05,
+            opacity=0.6,
+            pickable=False,
+        )
+        layers.append(heatmap_layer)
+    
     # 円レイヤー
     circle_layer = pdk.Layer(
         "ScatterplotLayer",
         id="prefecture_layer",
-        data=map_data,
+        data=points,
         get_position=["longitude", "latitude"],
-        get_color="color",
+        get_color=COLOR_ACCESSOR,
         get_radius="radius_pixels",
         pickable=True,
         opacity=0.8,
@@ -94,7 +191,7 @@ def create_prefecture_map(prefecture_data, selected_prefecture=None):
     text_layer = pdk.Layer(
         "TextLayer",
         id="prefecture_text_layer",
-        data=map_data,
+        data=labels,
         get_position=["longitude", "latitude"],
         get_text="count",
         get_size=16,
@@ -109,7 +206,7 @@ def create_prefecture_map(prefecture_data, selected_prefecture=None):
     layers.append(text_layer)
     
     # マップ作成
-    deck = pdk.Deck(
+    deck = SerializedDeck(
         layers=layers,
         initial_view_state=view_state,
         map_style="mapbox://styles/mapbox/light-v10",
@@ -148,41 +245,8 @@ def create_municipality_map(municipality_data, prefecture, selected_municipality
     )
     
     # データに色と適切な半径を追加
-    map_data = municipality_data.copy()
-    
-    def get_color(municipality, count, max_count):
-        if municipality == selected_municipality:
-            return [255, 165, 0, 255]  # オレンジ色（選択中）
-        else:
-            # 投稿数に応じて色の濃さを調整
-            if max_count > 0:
-                intensity = min(count / max_count, 1.0)
-                # 薄い紫から濃い紫へのグラデーション
-                red = 67 + int(100 * intensity)
-                green = 56 + int(50 * intensity)
-                blue = 202 + int(53 * intensity)
-                return [min(red, 167), min(green, 106), min(blue, 255), 220]
-            else:
-                return [67, 56, 202, 200]
-    
-    def calculate_radius(count, max_count):
-        """投稿数に基づいて適切な半径を計算（ピクセル単位）"""
-        min_radius = 20
-        max_radius = 70
-        
-        if max_count > 0:
-            normalized = count / max_count
-        else:
-            normalized = 0
-        
-        radius = min_radius + (max_radius - min_radius) * math.sqrt(normalized)
-        return int(radius)
-    
-    # 最大投稿数を取得
-    max_count = map_data['count'].max()
-    
-    map_data['color'] = map_data.apply(lambda row: get_color(row['municipality'], row['count'], max_count), axis=1)
-    map_data['radius_pixels'] = map_data['count'].apply(lambda x: calculate_radius(x, max_count))
+    map_data = style_municipality_points(municipality_data, selected_municipality)
+    points, labels = build_layer_payloads(map_data, 'municipality')
     
     # レイヤーリスト
     layers = []
@@ -191,9 +255,9 @@ def create_municipality_map(municipality_data, prefecture, selected_municipality
     circle_layer = pdk.Layer(
         "ScatterplotLayer",
         id="municipality_layer",
-        data=map_data,
+        data=points,
         get_position=["longitude", "latitude"],
-        get_color="color",
+        get_color=COLOR_ACCESSOR,
         get_radius="radius_pixels",
         pickable=True,
         opacity=0.8,
@@ -211,7 +275,7 @@ def create_municipality_map(municipality_data, prefecture, selected_municipality
     text_layer = pdk.Layer(
         "TextLayer",
         id="municipality_text_layer",
-        data=map_data,
+        data=labels,
         get_position=["longitude", "latitude"],
         get_text="count",
         get_size=14,
@@ -226,7 +290,7 @@ def create_municipality_map(municipality_data, prefecture, selected_municipality
     layers.append(text_layer)
     
     # マップ作成
-    deck = pdk.Deck(
+    deck = SerializedDeck(
         layers=layers,
         initial_view_state=view_state,
         map_style="mapbox://styles/mapbox/light-v10",
@@ -245,6 +309,101 @@ def create_municipality_map(municipality_data, prefecture, selected_municipality
     
     return deck
 
+def create_cluster_map(cluster_data, zoom_level):
+    """全国の投稿をクラスタにまとめたマップを作成"""
+    if cluster_data.empty:
+        return None
+    
+    view_state = pdk.ViewState(
+        latitude=36.5,
+        longitude=138.0,
+        zoom=zoom_level,
+        pitch=0
+    )
+    
+    map_data = style_cluster_points(cluster_data)
+    points, labels = build_layer_payloads(map_data, 'label', extra_columns=['locations'])
+    
+    circle_layer = pdk.Layer(
+        "ScatterplotLayer",
+        id="cluster_layer",
+        data=points,
+        get_position=["longitude", "latitude"],
+        get_color=COLOR_ACCESSOR,
+        get_radius="radius_pixels",
+        pickable=True,
+        opacity=0.8,
+        stroked=True,
+        filled=True,
+        radius_scale=1,
+        radius_min_pixels=15,
+        radius_max_pixels=60,
+        line_width_min_pixels=2,
+        get_line_color=[255, 255, 255, 255],
+    )
+    
+    text_layer = pdk.Layer(
+        "TextLayer",
+        id="cluster_text_layer",
+        data=labels,
+        get_position=["longitude", "latitude"],
+        get_text="count",
+        get_size=14,
+        get_color=[255, 255, 255, 255],
+        get_angle=0,
+        get_text_anchor='"middle"',
+        get_alignment_baseline='"center"',
+        pickable=False,
+        font_family='"Arial Black", Arial, sans-serif',
+        font_weight="bold"
+    )
+    
+    deck = SerializedDeck(
+        layers=[circle_layer, text_layer],
+        initial_view_state=view_state,
+        map_style="mapbox://styles/mapbox/light-v10",
+        tooltip={
+            "html": "<b>{label}</b> 周辺<br/>📍 {count}件の投稿<br/><small>{locations}地点をまとめて表示</small>",
+            "style": {
+                "backgroundColor": "white",
+                "color": "#262626",
+                "fontSize": "14px",
+                "padding": "10px",
+                "borderRadius": "8px",
+                "boxShadow": "0 2px 8px rgba(0,0,0,0.15)"
+            }
+        }
+    )
+    
+    return deck
+
+@st.cache_resource(max_entries=64)
+def _cached_prefecture_deck(revision, selected_prefecture, show_heatmap):
+    density_cells = logic.get_density_grid().cells() if show_heatmap else None
+    return create_prefecture_map(logic.count_by_prefecture(), selected_prefecture, density_cells)
+
+@st.cache_resource(max_entries=256)
+def _cached_municipality_deck(revision, prefecture, selected_municipality):
+    return create_municipality_map(
+        logic.count_by_municipality_in_prefecture(prefecture), prefecture, selected_municipality
+    )
+
+def get_prefecture_deck(selected_prefecture=None, show_heatmap=False):
+    """都道府県マップを取得（データリビジョン・選択・ヒートマップ表示ごとに作成済みのものを使い回す）"""
+    return _cached_prefecture_deck(logic.get_data_revision(), selected_prefecture, show_heatmap)
+
+def get_municipality_deck(prefecture, selected_municipality=None):
+    """市区町村マップを取得（データリビジョン・都道府県・選択ごとに作成済みのものを使い回す）"""
+    return _cached_municipality_deck(logic.get_data_revision(), prefecture, selected_municipality)
+
+@st.cache_resource(max_entries=32)
+def _cached_cluster_deck(revision, zoom_level):
+    return create_cluster_map(logic.get_cluster_index().clusters(zoom_level), zoom_level)
+
+def get_cluster_deck(zoom_level):
+    """全国クラスタマップを取得（クラスタはインデックスから引き、ズームレベルごとに作成済みのものを使い回す）"""
+    return _cached_cluster_deck(logic.get_data_revision(), zoom_level)
+
 def get_selected_object_from_session_state(key, map_data, map_type="prefecture"):
     """セッションステートから選択されたオブジェクトを取得"""
     if key not in st.session_state:
@@ -317,15 +476,11 @@ def create_reason_chart(filtered_df):
         return None
     
     # 理由の集計
-    all_reasons = []
-    for reasons_str in filtered_df['reasons'].dropna():
-        all_reasons.extend(str(reasons_str).split('|'))
+    reasons_count = logic.count_reasons(filtered_df)
     
-    if not all_reasons:
+    if reasons_count.empty:
         return None
     
-    reasons_count = pd.Series(all_reasons).value_counts()
-    
     # 上位10項目
     top_reasons = reasons_count.head(10)
     
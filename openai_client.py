@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+
+import httpx
+import openai
+import streamlit as st
+
+# OpenAI接続設定
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=5.0)  # 全体60秒、接続5秒
+OPENAI_MAX_RETRIES = 2
+OPENAI_MAX_CONNECTIONS = 20
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 10
+OPENAI_KEEPALIVE_EXPIRY = 60.0  # 使われていない接続を保持する秒数
+STREAM_METRICS_HISTORY = 200  # モデルごとに保持する直近の計測数
+STREAM_FRAME_INTERVAL = 0.05  # ストリームをまとめて返す間隔（秒）
+STREAM_FRAME_MAX_CHARS = 32  # 間隔内でもこの文字数に達したら返す
+
+
+@st.cache_resource
+def _create_client(api_key):
+    """接続プールを共有するOpenAIクライアントを作成（APIキーごとに1つ）"""
+    http_client = openai.DefaultHttpxClient(
+        timeout=OPENAI_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        )
+    )
+    return openai.OpenAI(
+        api_key=api_key,
+        timeout=OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client
+    )
+
+
+def get_openai_client():
+    """プロセス全体で共有するOpenAIクライアントを取得（APIキー未設定ならNone）"""
+    api_key = st.secrets.get("openai", {}).get("api_key")
+    if not api_key:
+        return None
+    return _create_client(api_key)
+
+
+class StreamMetrics:
+    """モデルごとの生成速度（最初のトークンまでの時間・全体時間・トークン/秒）を記録"""
+
+    def __init__(self, history=STREAM_METRICS_HISTORY):
+        self._lock = threading.Lock()
+        self._history = history
+        self._samples = {}
+
+    def record(self, model, ttft, latency, chunks, tokens):
+        sample = {
+            "ttft": ttft,
+            "latency": latency,
+            "chunks": chunks,
+            "tokens": tokens,
+            # 最初のトークン以降の出力速度
+            "tokens_per_sec": tokens / (latency - ttft) if ttft is not None and latency > ttft else None,
+        }
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self._history)).append(sample)
+        ttft_text = f"{ttft:.2f}s" if ttft is not None else "-"
+        print(f"OpenAI生成計測: model={model} ttft={ttft_text} latency={latency:.2f}s chunks={chunks} tokens={tokens}")
+
+    def summary(self):
+        """モデルごとの直近の計測値の平均"""
+        with self._lock:
+            samples = {model: list(values) for model, values in self._samples.items()}
+
+        def _mean(values):
+            values = [v for v in values if v is not None]
+            return sum(values) / len(values) if values else None
+
+        return {
+            model: {
+                "requests": len(values),
+                "avg_ttft": _mean([v["ttft"] for v in values]),
+                "avg_latency": _mean([v["latency"] for v in values]),
+                "avg_chunks": _mean([v["chunks"] for v in values]),
+                "avg_tokens_per_sec": _mean([v["tokens_per_sec"] for v in values]),
+            }
+            for model, values in samples.items()
+        }
+
+
+@st.cache_resource
+def get_stream_metrics():
+    """プロセス全体で共有する生成計測を取得"""
+    return StreamMetrics()
+
+
+def stream_chat(client, model, messages, **kwargs):
+    """チャット補完をストリーミングし、本文の断片を返すジェネレーター（速度を計測する）"""
+    started = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs
+    )
+
+    ttft = None
+    chunks = 0
+    tokens = None
+    for chunk in stream:
+        if chunk.usage is not None:
+            tokens = chunk.usage.completion_tokens
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            chunks += 1
+            yield chunk.choices[0].delta.content
+
+    # usageが返らない場合はチャンク数で近似する
+    get_stream_metrics().record(model, ttft, time.perf_counter() - started, chunks,
+                                tokens if tokens is not None else chunks)
+
+
+def coalesce_stream(chunks, interval=STREAM_FRAME_INTERVAL, max_chars=STREAM_FRAME_MAX_CHARS):
+    """細かい断片を時間・文字数の上限でまとめ、フレーム単位で返すジェネレーター
+
+    最初の断片はすぐに返し、以降はinterval秒経つかmax_chars文字溜まるごとに返す。
+    """
+    buffer = []
+    buffered_chars = 0
+    last_flush = None
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_chars += len(chunk)
+        now = time.perf_counter()
+        if last_flush is None or now - last_flush >= interval or buffered_chars >= max_chars:
+            yield "".join(buffer)
+            buffer = []
+            buffered_chars = 0
+            last_flush = now
+    if buffer:
+        yield "".join(buffer)
+
+
+def complete_chat(client, model, messages, **kwargs):
+    """ストリーミングしないチャット補完の本文を返す（全体時間を計測する）"""
+    started = time.perf_counter()
+    response = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    latency = time.perf_counter() - started
+    tokens = response.usage.completion_tokens if response.usage is not None else 0
+    # 一括応答なので最初のトークンまでの時間は全体時間と同じ
+    get_stream_metrics().record(model, latency, latency, 1, tokens)
+    return response.choices[0].message.content
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import pandas as pd
+
+import logic
+
+
+def make_posts():
+    dates = pd.to_datetime([f"2025-01-{day:02d} 10:00:00" for day in range(1, 29)] + [None, None])
+    return logic.sort_posts_by_time(pd.DataFrame({"submission_date": dates, "n": range(30)}))
+
+
+def period_numbers(df, **kwargs):
+    start, end = datetime(2025, 1, 5), datetime(2025, 1, 10)
+    return sorted(logic.filter_by_submission_period(df, start=start, end=end, **kwargs)["n"])
+
+
+def test_sorted_posts_are_sliced():
+    posts = make_posts()
+    dates = posts["submission_date"]
+    expected = sorted(posts[(dates > datetime(2025, 1, 5)) & (dates <= datetime(2025, 1, 10))]["n"])
+
+    assert period_numbers(posts, sorted_by_time=True) == expected
+    assert period_numbers(posts) == expected
+
+
+def test_unsorted_posts_are_compared_row_by_row():
+    posts = make_posts()
+    expected = period_numbers(posts, sorted_by_time=True)
+
+    assert period_numbers(posts.iloc[::-1]) == expected
+    assert period_numbers(posts.sort_values("submission_date", ascending=False)) == expected
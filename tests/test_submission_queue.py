@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+import logic
+
+
+class FakeWorksheet:
+    """gspreadのワークシートの代わりに、行をメモリに持つ"""
+
+    def __init__(self, rows, fail_reads=0):
+        self.rows = [list(logic.SHEET_COLUMNS)] + [list(row) for row in rows]
+        self.fail_reads = fail_reads
+        self.appended = []
+
+    def _read(self):
+        if self.fail_reads:
+            self.fail_reads -= 1
+            raise ConnectionError("シートを読み込めません")
+
+    def get_all_values(self):
+        self._read()
+        return [list(row) for row in self.rows]
+
+    def get(self, range_name):
+        self._read()
+        start = int(range_name.split(":")[0][1:])
+        return [list(row) for row in self.rows[start - 1:]]
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def append_rows(self, rows):
+        self.appended.extend(row[0] for row in rows)
+        self.rows.extend(list(row) for row in rows)
+
+
+def make_row(row_id):
+    values = dict.fromkeys(logic.SHEET_COLUMNS, "")
+    values.update(id=row_id, event_name="イベント", reasons="参加費が高額",
+                  submission_date="2025-06-01 10:00:00", event_prefecture="東京都")
+    return [values[column] for column in logic.SHEET_COLUMNS]
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    worksheet = FakeWorksheet([make_row("written")])
+    store = logic.PostStore()
+    monkeypatch.setattr(logic, "initialize_worksheet", lambda: worksheet)
+    monkeypatch.setattr(logic, "get_post_store", lambda: store)
+    # 裏のスレッドではなくテストからflushする
+    monkeypatch.setattr(logic, "SUBMISSION_FLUSH_INTERVAL", 3600)
+    return worksheet
+
+
+def write_journal(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({"op": "row", "row": row}, ensure_ascii=False) + "\n")
+
+
+def sheet_ids(worksheet):
+    return [row[0] for row in worksheet.rows[1:]]
+
+
+def test_replay_checks_sheet_when_startup_load_fails(sheet, tmp_path):
+    # "written" はシートに書き込み済みだが、ackを残す前に終了していた
+    journal = tmp_path / "journal.jsonl"
+    write_journal(journal, [make_row("written"), make_row("unsent")])
+    sheet.fail_reads = 1
+
+    queue = logic.SubmissionQueue(journal_path=str(journal))
+
+    assert queue.pending_count() == 2
+    assert queue.flush()
+    assert sheet.appended == ["unsent"]
+    assert sorted(sheet_ids(sheet)) == ["unsent", "written"]
+    assert queue.pending_count() == 0
+
+
+def test_replay_waits_while_sheet_is_unreadable(sheet, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    write_journal(journal, [make_row("written")])
+    sheet.fail_reads = 2
+
+    queue = logic.SubmissionQueue(journal_path=str(journal))
+
+    # 照合できないうちは送らない
+    assert not queue.flush()
+    assert sheet.appended == []
+    assert queue.flush()
+    assert sheet.appended == []
+    assert sheet_ids(sheet) == ["written"]
+
+
+def test_retry_after_failed_append_does_not_duplicate(sheet, tmp_path, monkeypatch):
+    queue = logic.SubmissionQueue(journal_path=str(tmp_path / "journal.jsonl"))
+    monkeypatch.setattr(logic, "get_submission_queue", lambda: queue)
+    append_rows = sheet.append_rows
+
+    def append_then_time_out(rows):
+        append_rows(rows)
+        raise TimeoutError("応答がありません")
+
+    sheet.append_rows = append_then_time_out
+    assert logic.append_row_to_sheet(dict(zip(logic.SHEET_COLUMNS, make_row("new"))))
+    assert "new" in set(logic.get_post_store().snapshot()['id'])
+    assert not queue.flush()
+
+    sheet.append_rows = append_rows
+    assert queue.flush()
+    assert sheet_ids(sheet) == ["written", "new"]
+    assert queue.pending_count() == 0
@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+from PIL import Image, ImageOps, features
+
+import logic
+
+# サムネイルの設定
+THUMBNAIL_DIR = os.path.join(logic.LOCAL_DATA_DIR, "thumbnails")
+THUMBNAIL_INDEX_FILE = os.path.join(THUMBNAIL_DIR, "index.sqlite3")
+THUMBNAIL_SIZE = (160, 160)  # 80pxの枠に高解像度ディスプレイでも粗くならない大きさ
+THUMBNAIL_QUALITY = 70
+IMAGE_BYTE_LIMIT = 8 * 1024 * 1024  # これより大きい画像は縮小しない
+IMAGE_FETCH_TIMEOUT = 10  # 秒
+THUMBNAIL_FAILURE_RETRY_INTERVAL = 6 * 60 * 60  # 取得・変換に失敗した画像を再試行するまでの時間（秒）
+
+# WebPが使えない環境ではJPEGにする
+THUMBNAIL_FORMAT, THUMBNAIL_MIME, THUMBNAIL_EXT = (
+    ("WEBP", "image/webp", "webp") if features.check("webp") else ("JPEG", "image/jpeg", "jpg")
+)
+
+
+def make_thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    """画像を中央で切り抜いて縮小し、WebP（またはJPEG）のバイト列にする"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("RGB", (size[0] * 2, size[1] * 2))  # JPEGは読み込み時点で縮小しておく
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if THUMBNAIL_FORMAT == "WEBP" and image.mode in ("RGBA", "LA", "P") else "RGB")
+        thumbnail = ImageOps.fit(image, size, method=Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    thumbnail.save(output, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+class ThumbnailStore:
+    """サムネイルを内容のハッシュをファイル名にして保存し、画像URLとの対応を記録する"""
+
+    def __init__(self, directory=THUMBNAIL_DIR, index_path=THUMBNAIL_INDEX_FILE):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            "image_url TEXT PRIMARY KEY, digest TEXT, retry_after REAL)"
+        )
+        self._conn.commit()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.{THUMBNAIL_EXT}")
+
+    def lookup(self, image_url):
+        """(保存済みのファイルパス or None, 取得を試すべきか)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, retry_after FROM thumbnails WHERE image_url = ?", (image_url,)
+            ).fetchone()
+        if row is None:
+            return None, True
+        digest, retry_after = row
+        if digest and os.path.exists(self._path(digest)):
+            return self._path(digest), False
+        return None, digest is not None or time.time() >= (retry_after or 0)
+
+    def save(self, image_url, thumbnail_bytes):
+        """サムネイルを保存してパスを返す（同じ内容のファイルは共有する）"""
+        digest = hashlib.sha256(thumbnail_bytes).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(thumbnail_bytes)
+            os.replace(temp_path, path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO thumbnails (image_url, digest, retry_after) VALUES (?, ?, NULL)",
+                (image_url, digest)
+            )
+            self._conn.commit()
+        return path
+
+    def record_failure(self, image_url):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO thumbnails (image_url, digest, retry_after) VALUES (?, NULL, ?)",
+                (image_url, time.time() + THUMBNAIL_FAILURE_RETRY_INTERVAL)
+            )
+            self._conn.commit()
+
+
+@st.cache_resource
+def get_thumbnail_store():
+    """プロセス全体で共有するサムネイルストアを取得"""
+    return ThumbnailStore()
+
+
+def _download_image(image_url, session):
+    with session.get(image_url, timeout=IMAGE_FETCH_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            data += chunk
+            if len(data) > IMAGE_BYTE_LIMIT:
+                raise ValueError(f"画像が大きすぎます（{IMAGE_BYTE_LIMIT}バイト超）")
+        return bytes(data)
+
+
+def ensure_thumbnail(image_url, session, store=None):
+    """画像URLのサムネイルを用意してパスを返す（未作成なら1回だけ取得・縮小する）"""
+    store = store or get_thumbnail_store()
+    path, should_fetch = store.lookup(image_url)
+    if path is not None or not should_fetch:
+        return path
+
+    try:
+        return store.save(image_url, make_thumbnail(_download_image(image_url, session)))
+    except Exception as e:
+        print(f"サムネイル作成エラー: {e}")
+        store.record_failure(image_url)
+        return None
+
+
+@st.cache_data(max_entries=500)
+def _read_data_uri(path):
+    # ファイル名が内容のハッシュなので、パスごとにキャッシュしてよい
+    with open(path, "rb") as f:
+        return f"data:{THUMBNAIL_MIME};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+
+def thumbnail_data_uri(image_url, session=None):
+    """サムネイルをdata URIで返す
+
+    sessionを渡したときは未作成なら作成し、渡さなければ作成済みのものだけを返す（なければNone）。
+    """
+    if not image_url:
+        return None
+    if session is not None:
+        path = ensure_thumbnail(image_url, session)
+    else:
+        path, _ = get_thumbnail_store().lookup(image_url)
+    return _read_data_uri(path) if path else None
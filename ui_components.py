@@ -2,7 +2,10 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 from datetime import datetime
+import html
 import logic
+import url_metadata
+import thumbnails
 
 def display_statistics_cards(stats):
     """統計情報をカード形式で表示"""
@@ -29,10 +32,7 @@ def display_filter_sidebar(df):
         st.markdown("### 🔍 フィルタ機能")
         
         # 理由フィルタ
-        all_reasons = []
-        for reasons_str in df['reasons'].dropna():
-            all_reasons.extend(str(reasons_str).split('|'))
-        unique_reasons = ["すべて"] + sorted(list(set(all_reasons)))
+        unique_reasons = ["すべて"] + sorted(logic.count_reasons(df).index)
         selected_reason = st.selectbox("🤔 理由", unique_reasons, key="reason_filter")
         
         # オンライン開催を含むかどうか
@@ -59,7 +59,7 @@ def apply_filters(df, filters):
     
     # 理由フィルタ
     if filters['selected_reason'] != "すべて":
-        filtered_df = filtered_df[filtered_df['reasons'].str.contains(filters['selected_reason'], na=False)]
+        filtered_df = logic.filter_by_reasons(filtered_df, filters['selected_reason'])
     
     # 期間フィルタ
     if filters['selected_period'] != "すべて":
@@ -67,26 +67,49 @@ def apply_filters(df, filters):
     
     return filtered_df
 
-def apply_date_filter(df, period):
-    """日付フィルタを適用"""
-    if df.empty:
+# 期間フィルタの選択肢と日数
+PERIOD_DAYS = {
+    "最近1週間": 7,
+    "最近1ヶ月": 30,
+    "最近3ヶ月": 90,
+}
+
+def apply_date_filter(df, period, sorted_by_time=False):
+    """日付フィルタを適用（日時順に並んでいるならsorted_by_time=Trueで二分探索する）"""
+    if df.empty or period not in PERIOD_DAYS:
         return df
     
-    df_temp = df.copy()
-    df_temp['submission_date'] = pd.to_datetime(df_temp['submission_date'], errors='coerce')
-    
-    current_time = datetime.now()
-    
-    if period == "最近1週間":
-        cutoff = current_time - pd.Timedelta(days=7)
-    elif period == "最近1ヶ月":
-        cutoff = current_time - pd.Timedelta(days=30)
-    elif period == "最近3ヶ月":
-        cutoff = current_time - pd.Timedelta(days=90)
-    else:
-        return df_temp
-    
-    return df_temp[df_temp['submission_date'] > cutoff]
+    return logic.filter_recent_posts(df, PERIOD_DAYS[period], sorted_by_time=sorted_by_time)
+
+def build_url_preview_html(url):
+    """保存済みのURLメタデータから小さなプレビューカードのHTMLを作る
+
+    ネットワークには出ず、まだ取得されていなければリンクだけを返す。
+    """
+    url = str(url).strip()
+    safe_url = html.escape(url, quote=True)
+    metadata = url_metadata.get_metadata_fetcher().get_cached(url)
+    if not metadata or not metadata.get('title'):
+        return f'<a href="{safe_url}" target="_blank">🔗 イベントページ</a>'
+    
+    # 画像は縮小済みのサムネイルがあるときだけ埋め込む（外部サイトから直接読ませない）
+    thumbnail = thumbnails.thumbnail_data_uri(metadata.get('image'))
+    image_html = ''
+    if thumbnail:
+        image_html = f'<img src="{thumbnail}" style="width: 56px; height: 56px; object-fit: cover; border-radius: 6px; flex-shrink: 0;" />'
+    
+    description = metadata.get('description') or ''
+    if len(description) > 60:
+        description = description[:60] + "..."
+    description_html = f'<div style="color: #8e8e8e; font-size: 0.8rem;">{html.escape(description)}</div>' if description else ''
+    
+    return (
+        f'<a href="{safe_url}" target="_blank" style="text-decoration: none;">'
+        f'<div style="display: flex; gap: 0.75rem; border: 1px solid #e1e5e9; border-radius: 8px; padding: 0.5rem; margin: 0.5rem 0;">'
+        f'{image_html}'
+        f'<div style="min-width: 0;"><div style="font-weight: bold; color: #262626; font-size: 0.9rem;">{html.escape(metadata["title"])}</div>'
+        f'{description_html}</div></div></a>'
+    )
 
 def display_post_cards(posts_df, title="投稿一覧", posts_per_page=10):
     """投稿をカード形式で表示（ページネーション付き）"""
@@ -135,7 +158,7 @@ def display_post_cards(posts_df, title="投稿一覧", posts_per_page=10):
             
             # イベントURL
             if row.get('event_url') and row['event_url'].strip():
-                st.markdown(f"🔗 [イベントページ]({row['event_url']})")
+                st.markdown(build_url_preview_html(row['event_url']), unsafe_allow_html=True)
             
             # 理由
             reasons = row['reasons'].split('|') if isinstance(row['reasons'], str) else []
@@ -153,7 +176,7 @@ def display_post_cards(posts_df, title="投稿一覧", posts_per_page=10):
                 st.write(f"💭 {comment_text}")
             
             # 投稿日時
-            if row.get('submission_date'):
+            if pd.notna(row.get('submission_date')):
                 st.caption(f"🕒 {row['submission_date']}")
             
             st.markdown("---")
@@ -165,15 +188,12 @@ def display_reason_analysis(filtered_df):
         return
     
     # 理由の集計
-    all_reasons = []
-    for reasons_str in filtered_df['reasons'].dropna():
-        all_reasons.extend(str(reasons_str).split('|'))
+    reasons_count = logic.count_reasons(filtered_df)
     
-    if not all_reasons:
+    if reasons_count.empty:
         st.info("📊 理由データがありません")
         return
     
-    reasons_count = pd.Series(all_reasons).value_counts()
     top_reasons = reasons_count.head(10)
     
     col1, col2 = st.columns([2, 1])
@@ -277,12 +297,10 @@ def display_summary_stats(selected_prefecture=None, selected_municipality=None,
     
     with col4:
         # 最も多い理由
-        all_reasons = []
-        for reasons_str in filtered_df['reasons'].dropna():
-            all_reasons.extend(str(reasons_str).split('|'))
+        reasons_count = logic.count_reasons(filtered_df)
         
-        if all_reasons:
-            top_reason = pd.Series(all_reasons).value_counts().index[0]
+        if not reasons_count.empty:
+            top_reason = reasons_count.index[0]
             st.metric("主な理由", top_reason[:10] + "..." if len(top_reason) > 10 else top_reason)
 
 def create_export_buttons(filtered_df, area_name="データ"):
@@ -296,7 +314,7 @@ def create_export_buttons(filtered_df, area_name="データ"):
     
     with col1:
         # CSV エクスポート
-        csv = filtered_df.to_csv(index=False, encoding='utf-8-sig')
+        csv = filtered_df.drop(columns=logic.DERIVED_COLUMNS, errors='ignore').to_csv(index=False, encoding='utf-8-sig')
         st.download_button(
             label="📊 CSV ダウンロード",
             data=csv,
@@ -316,12 +334,8 @@ def create_export_buttons(filtered_df, area_name="データ"):
     
     with col3:
         # 理由一覧
-        all_reasons = []
-        for reasons_str in filtered_df['reasons'].dropna():
-            all_reasons.extend(str(reasons_str).split('|'))
-        
         reasons_text = "\n".join([f"{reason}: {count}件" 
-                                 for reason, count in pd.Series(all_reasons).value_counts().items()])
+                                 for reason, count in logic.count_reasons(filtered_df).items()])
         
         st.download_button(
             label="📝 理由一覧",
@@ -336,11 +350,7 @@ def create_simple_report(df, area_name):
         return "データがありません"
     
     # 理由の集計
-    all_reasons = []
-    for reasons_str in df['reasons'].dropna():
-        all_reasons.extend(str(reasons_str).split('|'))
-    
-    reasons_count = pd.Series(all_reasons).value_counts() if all_reasons else pd.Series()
+    reasons_count = logic.count_reasons(df)
     
     report = f"""
 {area_name} 統計レポート
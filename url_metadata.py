@@ -0,0 +1,509 @@
+import codecs
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import requests
+import streamlit as st
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+import logic
+import thumbnails
+
+# URLメタデータ取得の設定
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+FETCH_TIMEOUT = 10  # 秒
+FETCH_CHUNK_SIZE = 8 * 1024
+HEAD_BYTE_LIMIT = 256 * 1024  # </head>が見つからなくてもここで読むのをやめる
+CHARSET_SNIFF_BYTES = 4 * 1024  # <meta charset>を探す先頭バイト数
+
+# メタデータ保存・再検証の設定
+METADATA_STORE_FILE = os.path.join(logic.LOCAL_DATA_DIR, "url_metadata.sqlite3")
+METADATA_REVALIDATE_INTERVAL = 60 * 60  # この間は再検証せずに保存済みのものを使う（秒）
+METADATA_FAILURE_RETRY_INTERVAL = 15 * 60  # 取得に失敗したURLを再び取りに行くまでの時間（秒）
+MAX_CONCURRENT_FETCHES = 4  # 同時に外部サイトへ取りに行く数
+POOL_HOSTS = 32  # 接続を保持しておくホスト数
+POOL_CONNECTIONS_PER_HOST = 4
+
+# 投稿済みURLの裏取得の設定
+BACKFILL_WORKERS = 4
+BACKFILL_HOST_INTERVAL = 1.0  # 同じホストへのリクエスト間隔（秒）
+BACKFILL_RESCAN_INTERVAL = 60 * 60  # データが変わらなくても再検証対象を探し直す間隔（秒）
+
+# 304 Not Modified を表す戻り値
+NOT_MODIFIED = object()
+
+# 正規化時に取り除くトラッキング用クエリ
+_TRACKING_PARAMS = {'fbclid', 'gclid'}
+
+# プレビューに使うmetaタグ（property/name属性の値）
+_WANTED_META = {'og:title', 'og:description', 'og:image', 'description'}
+_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+_HEADER_CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+
+
+class _HeadMetaParser(HTMLParser):
+    """<head>内の<title>と必要なmetaタグだけを拾うパーサー"""
+
+    def __init__(self):
+        super().__init__()
+        self.title = None
+        self.meta = {}
+        self.charset = None
+        self.done = False
+        self._title_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            self.done = True
+        elif tag == 'title' and self.title is None:
+            self._title_parts = []
+        elif tag == 'meta':
+            attrs = dict(attrs)
+            if self.charset is None:
+                if attrs.get('charset'):
+                    self.charset = attrs['charset'].strip()
+                elif (attrs.get('http-equiv') or '').lower() == 'content-type':
+                    match = _HEADER_CHARSET_PATTERN.search(attrs.get('content') or '')
+                    self.charset = match.group(1) if match else None
+            key = (attrs.get('property') or attrs.get('name') or '').strip().lower()
+            if key in _WANTED_META and key not in self.meta:
+                self.meta[key] = (attrs.get('content') or '').strip()
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+        elif tag == 'title' and self._title_parts is not None:
+            self.title = ''.join(self._title_parts).strip()
+            self._title_parts = None
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+
+def _lookup_codec(name):
+    try:
+        return codecs.lookup(name.decode('ascii') if isinstance(name, bytes) else name).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def _sniff_encoding(response, head):
+    """BOM → Content-Type → 先頭の<meta charset> の順で文字コードを決める
+
+    (文字コード, 確定したか) を返す。決められなければ仮にUTF-8とする。
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig', True
+    match = _HEADER_CHARSET_PATTERN.search(response.headers.get('Content-Type', ''))
+    if match and _lookup_codec(match.group(1)):
+        return _lookup_codec(match.group(1)), True
+    match = _CHARSET_PATTERN.search(head[:CHARSET_SNIFF_BYTES])
+    if match and _lookup_codec(match.group(1)):
+        return _lookup_codec(match.group(1)), True
+    return 'utf-8', False
+
+
+def _build_metadata(url, title, description, image_url):
+    # 相対URLの場合は絶対URLに変換
+    if image_url and not image_url.startswith('http'):
+        image_url = urljoin(url, image_url)
+    return {
+        'title': title,
+        'description': description,
+        'image': image_url,
+        'url': url
+    }
+
+
+def _request_headers(headers):
+    return {'User-Agent': USER_AGENT, **(headers or {})}
+
+
+def extract_head_metadata(url, session=requests, headers=None):
+    """本文を少しずつ読み、</head>かバイト上限で打ち切ってメタデータを取り出す
+
+    (メタデータ, レスポンスヘッダー) を返す。必要なタグが1つも見つからなければ
+    メタデータはNone、条件付きGETで304が返ればNOT_MODIFIED。
+    """
+    parser = _HeadMetaParser()
+    with session.get(url, headers=_request_headers(headers), timeout=FETCH_TIMEOUT, stream=True) as response:
+        if response.status_code == 304:
+            return NOT_MODIFIED, response.headers
+        response.raise_for_status()
+
+        raw = bytearray()
+        decoder = None
+        encoding, confirmed = 'utf-8', False
+        for chunk in response.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+            raw += chunk
+            if decoder is None:
+                # 文字コード判定に十分なバイトが溜まるまで待つ
+                if len(raw) < CHARSET_SNIFF_BYTES:
+                    continue
+                encoding, confirmed = _sniff_encoding(response, bytes(raw))
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+                chunk = bytes(raw)
+            parser.feed(decoder.decode(chunk))
+            if parser.done or len(raw) >= HEAD_BYTE_LIMIT:
+                break
+        else:
+            if decoder is None:
+                encoding, confirmed = _sniff_encoding(response, bytes(raw))
+                parser.feed(bytes(raw).decode(encoding, errors='replace'))
+            else:
+                parser.feed(decoder.decode(b'', final=True))
+
+    # 先頭より後ろの<meta charset>で別の文字コードが指定されていたら読み直す
+    declared = _lookup_codec(parser.charset) if parser.charset else None
+    if not confirmed and declared and declared != encoding:
+        parser = _HeadMetaParser()
+        parser.feed(bytes(raw).decode(declared, errors='replace'))
+
+    if parser.title is None and not parser.meta:
+        return None, response.headers
+    return _build_metadata(
+        url,
+        parser.meta.get('og:title') or parser.title,
+        parser.meta.get('og:description') or parser.meta.get('description'),
+        parser.meta.get('og:image')
+    ), response.headers
+
+
+def extract_full_metadata(url, session=requests, headers=None):
+    """ページ全体をBeautifulSoupで解析してメタデータを取り出す（フォールバック用）
+
+    戻り値はextract_head_metadataと同じ形。
+    """
+    response = session.get(url, headers=_request_headers(headers), timeout=FETCH_TIMEOUT)
+    if response.status_code == 304:
+        return NOT_MODIFIED, response.headers
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    # タイトル取得（OGタイトルを優先）
+    title = None
+    title_tag = soup.find('title')
+    if title_tag:
+        title = title_tag.get_text().strip()
+    og_title = soup.find('meta', property='og:title')
+    if og_title:
+        title = og_title.get('content', '').strip()
+
+    # 説明取得（OG説明を優先）
+    description = None
+    meta_desc = soup.find('meta', attrs={'name': 'description'})
+    if meta_desc:
+        description = meta_desc.get('content', '').strip()
+    og_desc = soup.find('meta', property='og:description')
+    if og_desc:
+        description = og_desc.get('content', '').strip()
+
+    # 画像取得
+    image_url = None
+    og_image = soup.find('meta', property='og:image')
+    if og_image:
+        image_url = og_image.get('content', '').strip()
+
+    return _build_metadata(url, title, description, image_url), response.headers
+
+
+def fetch_url_metadata(url, session=requests, headers=None):
+    """URLからメタデータ（タイトル、説明、画像）を取得
+
+    まず<head>だけを読む軽量な解析を試し、取れなければページ全体を解析する。
+    (メタデータ, レスポンスヘッダー) を返す。
+    """
+    try:
+        metadata, response_headers = extract_head_metadata(url, session, headers)
+        if metadata is not None:
+            return metadata, response_headers
+    except requests.RequestException:
+        raise  # 通信エラーは全体解析でも同じなのでそのまま返す
+    except Exception as e:
+        print(f"URL メタデータの軽量取得に失敗（全体解析に切り替え）: {e}")
+    return extract_full_metadata(url, session, headers)
+
+
+def canonicalize_url(url):
+    """保存用のキーとしてURLを正規化（ホスト小文字化・既定ポートとフラグメント・トラッキング用クエリを除去）"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not (scheme == 'http' and parts.port == 80) and not (scheme == 'https' and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in _TRACKING_PARAMS
+    ])
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def create_session():
+    """ホストごとに接続を使い回すrequestsセッションを作成"""
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_CONNECTIONS_PER_HOST)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class MetadataStore:
+    """URLメタデータをSQLiteに保存するストア（正規化URLがキー）
+
+    取得に失敗したURLも記録し、retry_afterまでは取りに行かない。
+    """
+
+    def __init__(self, path=METADATA_STORE_FILE):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS url_metadata ("
+            "url TEXT PRIMARY KEY, title TEXT, description TEXT, image TEXT, "
+            "etag TEXT, last_modified TEXT, has_content INTEGER NOT NULL, "
+            "fetched_at REAL, retry_after REAL NOT NULL, failures INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    def get(self, url):
+        """保存済みの記録（なければNone）"""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM url_metadata WHERE url = ?", (url,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def save(self, url, metadata, etag, last_modified, retry_after):
+        """取得したメタデータを保存"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO url_metadata "
+                "(url, title, description, image, etag, last_modified, has_content, fetched_at, retry_after, failures) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, 0)",
+                (url, metadata.get('title'), metadata.get('description'), metadata.get('image'),
+                 etag, last_modified, time.time(), retry_after)
+            )
+            self._conn.commit()
+
+    def touch(self, url, retry_after):
+        """304で内容が変わっていなかったときに次の再検証時刻だけ進める"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE url_metadata SET retry_after = ?, failures = 0 WHERE url = ?", (retry_after, url)
+            )
+            self._conn.commit()
+
+    def record_failure(self, url, retry_after):
+        """取得失敗を記録（保存済みの内容があれば残す）"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO url_metadata (url, has_content, retry_after, failures) VALUES (?, 0, ?, 1) "
+                "ON CONFLICT(url) DO UPDATE SET retry_after = excluded.retry_after, failures = failures + 1",
+                (url, retry_after)
+            )
+            self._conn.commit()
+
+
+def _record_to_metadata(record, url):
+    return {
+        'title': record['title'],
+        'description': record['description'],
+        'image': record['image'],
+        'url': url
+    }
+
+
+class UrlMetadataFetcher:
+    """保存済みメタデータを優先し、期限が来たら条件付きGETで再検証する取得器"""
+
+    def __init__(self, store=None, session=None, max_concurrent=MAX_CONCURRENT_FETCHES):
+        self.store = store or MetadataStore()
+        self.session = session or create_session()
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def is_due(self, url):
+        """未取得か、再検証・再試行の時刻を過ぎているか"""
+        record = self.store.get(canonicalize_url(url))
+        return record is None or time.time() >= record['retry_after']
+
+    def get_cached(self, url):
+        """ネットワークに出ずに保存済みのメタデータだけを返す（なければNone）"""
+        record = self.store.get(canonicalize_url(url))
+        if record is None or not record['has_content']:
+            return None
+        return _record_to_metadata(record, url)
+
+    def get(self, url):
+        """URLのメタデータを取得（失敗して保存済みのものもなければNone）"""
+        key = canonicalize_url(url)
+        record = self.store.get(key)
+        if record is not None and time.time() < record['retry_after']:
+            return _record_to_metadata(record, url) if record['has_content'] else None
+
+        # 保存済みの内容があれば条件付きGETで変更の有無だけ確かめる
+        headers = {}
+        if record is not None and record['has_content']:
+            if record['etag']:
+                headers['If-None-Match'] = record['etag']
+            if record['last_modified']:
+                headers['If-Modified-Since'] = record['last_modified']
+
+        try:
+            with self._semaphore:
+                metadata, response_headers = fetch_url_metadata(url, self.session, headers)
+        except Exception as e:
+            print(f"URL メタデータ取得エラー: {e}")
+            self.store.record_failure(key, time.time() + METADATA_FAILURE_RETRY_INTERVAL)
+            if record is not None and record['has_content']:
+                return _record_to_metadata(record, url)
+            return None
+
+        next_check = time.time() + METADATA_REVALIDATE_INTERVAL
+        if metadata is NOT_MODIFIED:
+            self.store.touch(key, next_check)
+            return _record_to_metadata(record, url)
+
+        self.store.save(key, metadata, response_headers.get('ETag'), response_headers.get('Last-Modified'), next_check)
+        return metadata
+
+
+@st.cache_resource
+def get_metadata_fetcher():
+    """プロセス全体で共有するURLメタデータ取得器を取得"""
+    return UrlMetadataFetcher()
+
+
+class HostRateLimiter:
+    """ホストごとにリクエストの間隔を空ける"""
+
+    def __init__(self, interval=BACKFILL_HOST_INTERVAL):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, host):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MetadataBackfill:
+    """投稿済みのevent_urlのメタデータを裏で取得し、ストアに保存しておくワーカー
+
+    フィードは保存済みのものだけを表示するので、表示時にネットワークへ出ない。
+    URL一覧の走査も裏のスレッドで行い、画面の処理はリビジョンを知らせるだけにする。
+    """
+
+    def __init__(self, fetcher, load_posts, workers=BACKFILL_WORKERS, host_interval=BACKFILL_HOST_INTERVAL):
+        self._fetcher = fetcher
+        self._load_posts = load_posts
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metadata-backfill")
+        self._limiter = HostRateLimiter(host_interval)
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._requested_revision = None
+        self._scanned_revision = None
+        self._scanned_at = 0.0
+        self._scan_wakeup = threading.Event()
+        self._scanner = threading.Thread(target=self._scan_loop, name="metadata-backfill-scan", daemon=True)
+        self._scanner.start()
+
+    def request_scan(self, revision):
+        """データのリビジョンを知らせる（変わっていれば裏のスレッドが走査する）"""
+        with self._lock:
+            if revision == self._requested_revision:
+                return
+            self._requested_revision = revision
+        self._scan_wakeup.set()
+
+    def schedule(self, urls):
+        """取得・再検証が必要なURLをワーカーに積む（積んだ件数を返す）"""
+        scheduled = 0
+        for url in urls:
+            key = canonicalize_url(url)
+            with self._lock:
+                if key in self._in_flight:
+                    continue
+                self._in_flight.add(key)
+            if not self._fetcher.is_due(url):
+                with self._lock:
+                    self._in_flight.discard(key)
+                continue
+            self._executor.submit(self._fetch, url, key)
+            scheduled += 1
+        return scheduled
+
+    def needs_scan(self, revision):
+        """データが変わったか、前回の走査から一定時間経ったか"""
+        with self._lock:
+            return (revision != self._scanned_revision
+                    or time.time() - self._scanned_at >= BACKFILL_RESCAN_INTERVAL)
+
+    def scan(self, urls, revision):
+        """URL一覧を走査して必要なものを積む"""
+        with self._lock:
+            self._scanned_revision = revision
+            self._scanned_at = time.time()
+        return self.schedule(urls)
+
+    def _scan_loop(self):
+        while True:
+            # 知らせがなくても一定時間ごとに再検証対象を探し直す
+            self._scan_wakeup.wait(timeout=BACKFILL_RESCAN_INTERVAL)
+            self._scan_wakeup.clear()
+            with self._lock:
+                revision = self._requested_revision
+            if revision is None or not self.needs_scan(revision):
+                continue
+            try:
+                self.scan(event_urls(self._load_posts()), revision)
+            except Exception as e:
+                print(f"URL メタデータの走査エラー: {e}")
+
+    def _fetch(self, url, key):
+        try:
+            self._limiter.wait(urlsplit(key).netloc)
+            metadata = self._fetcher.get(url)
+            # プレビュー画像も縮小して保存しておく
+            image = (metadata.get('image') or '') if metadata else ''
+            if image.startswith(('http://', 'https://')):
+                self._limiter.wait(urlsplit(image).netloc)
+                thumbnails.ensure_thumbnail(image, self._fetcher.session)
+        except Exception as e:
+            print(f"URL メタデータの裏取得エラー: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+
+@st.cache_resource
+def get_metadata_backfill():
+    """プロセス全体で共有する裏取得ワーカーを取得"""
+    return MetadataBackfill(get_metadata_fetcher(), lambda: logic.get_post_store().snapshot())
+
+
+def event_urls(df):
+    """投稿データのevent_url（重複なし、http(s)のみ）"""
+    if df.empty or 'event_url' not in df.columns:
+        return []
+    urls = df['event_url'].dropna().astype(str).str.strip().unique()
+    return [url for url in urls if url.startswith(('http://', 'https://'))]
+
+
+def backfill_event_urls(revision):
+    """投稿データのevent_urlのメタデータ取得を裏で開始（走査も裏のスレッドで行う）"""
+    get_metadata_backfill().request_scan(revision)
@@ -1,19 +1,22 @@
 import streamlit as st
 import streamlit.components.v1 as components  # 追加：確実なスクロール制御のため
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
 import pydeck as pdk
 import altair as alt
 from datetime import datetime
 import uuid
+import threading
 import os
-import openai
 import urllib.parse
 import re
-import requests
-from bs4 import BeautifulSoup
 
 # 自作モジュールをインポート
 import logic
+import generation_cache
+import openai_client
+import url_metadata
+import thumbnails
 import map_utils
 import ui_components
 
@@ -487,41 +490,8 @@ button[kind="primary"] {
 </style>
 """, unsafe_allow_html=True)
 
-# 改善された理由のリスト（カテゴリ別に整理）
-IMPROVED_REASONS = {
-    "👶 子育て・家族関連": [
-        "子どもの預け先がない",
-        "託児サービスがない/高額",
-        "子どもが病気・体調不良",
-        "授乳・おむつ替えの設備不足",
-        "子連れ参加が困難な雰囲気",
-        "家族の介護が必要",
-        "家族の理解・協力が得られない"
-    ],
-    "💼 仕事・時間関連": [
-        "仕事の都合がつかない",
-        "会社で許可が降りなかった", 
-        "残業・緊急対応が入った",
-        "シフト勤務で調整困難",
-        "有給取得が難しい",
-        "参加が難しい時間"
-    ],
-    "💰 経済・アクセス関連": [
-        "参加費が高額",
-        "交通費が負担",
-        "遠方で参加困難",
-        "交通アクセスが悪い",
-        "宿泊費が負担"
-    ],
-    "📢 情報・その他": [
-        "開催情報を知るのが遅かった",
-        "申込み締切に間に合わなかった",
-        "定員に達していた",
-        "自分の体調不良",
-        "天候不良",
-        "その他"
-    ]
-}
+# 改善された理由のリスト（カテゴリ別に整理、logicで一元管理）
+IMPROVED_REASONS = logic.IMPROVED_REASONS
 
 # ユーティリティ関数
 def is_valid_url(url):
@@ -542,61 +512,14 @@ def is_valid_url(url):
 
     return re.match(url_pattern, url) is not None
 
-@st.cache_data(ttl=3600)  # 1時間キャッシュ
 def get_url_metadata(url):
     """URLからメタデータ（タイトル、説明、画像）を取得"""
     if not url or not is_valid_url(url):
         return None
     
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # タイトル取得
-        title = None
-        title_tag = soup.find('title')
-        if title_tag:
-            title = title_tag.get_text().strip()
-        
-        # OGタイトル取得（優先）
-        og_title = soup.find('meta', property='og:title')
-        if og_title:
-            title = og_title.get('content', '').strip()
-        
-        # 説明取得
-        description = None
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        if meta_desc:
-            description = meta_desc.get('content', '').strip()
-        
-        # OG説明取得（優先）
-        og_desc = soup.find('meta', property='og:description')
-        if og_desc:
-            description = og_desc.get('content', '').strip()
-        
-        # 画像取得
-        image_url = None
-        og_image = soup.find('meta', property='og:image')
-        if og_image:
-            image_url = og_image.get('content', '').strip()
-            # 相対URLの場合は絶対URLに変換
-            if image_url and not image_url.startswith('http'):
-                from urllib.parse import urljoin
-                image_url = urljoin(url, image_url)
-        
-        return {
-            'title': title,
-            'description': description,
-            'image': image_url,
-            'url': url
-        }
-        
+        # ディスクに保存済みのものを優先し、期限が来たら条件付きGETで再検証
+        return url_metadata.get_metadata_fetcher().get(url)
     except Exception as e:
         print(f"URL メタデータ取得エラー: {e}")
         return None
@@ -606,6 +529,11 @@ def display_url_preview(metadata):
     if not metadata:
         return
     
+    # 元画像ではなく、縮小してローカルに保存したサムネイルを埋め込む
+    image_src = None
+    if metadata.get('image'):
+        image_src = thumbnails.thumbnail_data_uri(metadata['image'], session=url_metadata.get_metadata_fetcher().session)
+    
     st.markdown(f"""
     <div style="
         border: 1px solid #e1e5e9;
@@ -616,7 +544,7 @@ def display_url_preview(metadata):
         box-shadow: 0 1px 3px rgba(0,0,0,0.1);
     ">
         <div style="display: flex; gap: 1rem;">
-            {'<div style="flex-shrink: 0;"><img src="' + metadata['image'] + '" style="width: 80px; height: 80px; object-fit: cover; border-radius: 8px;" /></div>' if metadata.get('image') else ''}
+            {'<div style="flex-shrink: 0;"><img src="' + image_src + '" style="width: 80px; height: 80px; object-fit: cover; border-radius: 8px;" /></div>' if image_src else ''}
             <div style="flex: 1;">
                 <div style="font-weight: bold; margin-bottom: 0.5rem; color: #262626;">
                     {metadata.get('title', 'イベント情報')}
@@ -659,26 +587,19 @@ def generate_tweet_text_from_post_content(post_content, event_location):
         "url": f"https://twitter.com/intent/tweet?text={encoded_text}"
     }
 
-# データのキャッシュ設定
-@st.cache_data(ttl=300)
-def cached_load_data():
-    return logic.load_data()
-
 # AIコメント生成関連（既存のコードを使用）
 NG_WORDS = ["寄り添", "共感", "お察し", "深く理解", "寄り添いたい"]
+EMPATHY_FALLBACK_MESSAGE = "お忙しい中、貴重な体験を共有していただきありがとうございます。\n\n行きたかったけど行けなかった気持ち、本当によく分かります。特に子育て中は、自分の時間を作ることすら難しいですよね。\n\nあなたのこの声はとても大切です。一人ひとりの「行きたかった」が集まることで、より参加しやすい社会を作る力になります。"
 
 def generate_empathy_comment_stream(event_name, reasons, comment):
     """ストリーミング対応のAIコメント生成ジェネレーター"""
     try:
-        api_key = st.secrets.get("openai", {}).get("api_key")
-        if not api_key:
+        client = openai_client.get_openai_client()
+        if client is None:
             default_message = "お忙しい中、貴重な体験を共有していただきありがとうございます。\n\n行きたかったけど行けなかった気持ち、本当によく分かります。特に子育て中は、自分の時間を作ることすら難しいですよね。\n\nでも、あなたのこの声はとても大切です。一人ひとりの「行きたかった」が集まることで、社会の見えない障壁が見えてきます。\n\nきっと同じ思いをしている方がたくさんいるはずです。あなたの勇気ある投稿が、より参加しやすい社会を作る第一歩になります。"
-            for char in default_message:
-                yield char
+            yield default_message
             return
         
-        client = openai.OpenAI(api_key=api_key)
-        
         prompt = f"""
 「{event_name}」に行きたかったけど行けなかった方への、深い共感と希望のメッセージを作成してください。
 
@@ -708,41 +629,31 @@ def generate_empathy_comment_stream(event_name, reasons, comment):
 重要：特に子育て中の困難（託児の問題、時間の制約、周囲の理解不足など）に対する深い理解を示し、それを個人の問題ではなく社会の構造的な問題として変えていこうということを伝えてください。
 """
         
-        stream = client.chat.completions.create(
+        # 同じ条件での生成はキャッシュから再生する（トークンはフレーム単位にまとめて返す）
+        yield from openai_client.coalesce_stream(generation_cache.stream_chat_completion(
+            client,
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "あなたは社会課題の解決に取り組む共感力豊かなカウンセラーです。特に子育て中の方や働く方々が直面する困難を深く理解し、個人の体験を社会課題として捉え、集合的な力で変化を起こすことを信じています。"},
-                {"role": "user", "content": prompt}
-            ],
+            system_prompt="あなたは社会課題の解決に取り組む共感力豊かなカウンセラーです。特に子育て中の方や働く方々が直面する困難を深く理解し、個人の体験を社会課題として捉え、集合的な力で変化を起こすことを信じています。",
+            user_prompt=prompt,
             temperature=0.8,
-            max_tokens=1200,
-            stream=True
-        )
-        
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+            max_tokens=1200
+        ))
                 
     except Exception as e:
         print(f"AIコメント生成エラー: {e}")
-        default_message = "お忙しい中、貴重な体験を共有していただきありがとうございます。\n\n行きたかったけど行けなかった気持ち、本当によく分かります。特に子育て中は、自分の時間を作ることすら難しいですよね。\n\nあなたのこの声はとても大切です。一人ひとりの「行きたかった」が集まることで、より参加しやすい社会を作る力になります。"
-        for char in default_message:
-            yield char
+        yield EMPATHY_FALLBACK_MESSAGE
 
-def generate_engaging_post_stream(event_name, reasons, comment, event_location):
+def generate_engaging_post_stream(event_name, reasons, comment, event_location, use_cache=True):
     """個人の生々しい感情を表現する投稿内容をストリーミング生成（コメント重視）"""
     try:
-        api_key = st.secrets.get("openai", {}).get("api_key")
-        if not api_key:
+        client = openai_client.get_openai_client()
+        if client is None:
             # デフォルトの投稿文（より個人的で感情的）
             reason_text = "、".join(reasons[:3])
             default_post = f"楽しみにしていた #{event_name}。でも{reason_text}で泣く泣く断念…😭"
-            for char in default_post:
-                yield char
+            yield default_post
             return
         
-        client = openai.OpenAI(api_key=api_key)
-        
         # 理由を整理（最大3つまで）
         main_reasons = reasons[:3] if len(reasons) > 3 else reasons
         reason_text = "、".join(main_reasons)
@@ -810,20 +721,16 @@ SNSの個人投稿として、本人の生々しい感情を表現する短い
 ユーザーのコメントがある場合は、その内容を投稿文の核として使用してください。
 """
         
-        stream = client.chat.completions.create(
+        # 同じ条件での生成はキャッシュから再生する（再生成時はuse_cache=Falseで作り直す）
+        yield from openai_client.coalesce_stream(generation_cache.stream_chat_completion(
+            client,
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "あなたは個人の感情表現の専門家です。第三者視点は一切使わず、本人の生々しく率直な感情のみを短い文章で表現することが得意です。前向きなメッセージや社会的な呼びかけは絶対に含めません。カッコは絶対に使いません。複数の理由を自然に組み込むことができます。ユーザーのコメントがある場合は、それを最優先で反映します。"},
-                {"role": "user", "content": prompt}
-            ],
+            system_prompt="あなたは個人の感情表現の専門家です。第三者視点は一切使わず、本人の生々しく率直な感情のみを短い文章で表現することが得意です。前向きなメッセージや社会的な呼びかけは絶対に含めません。カッコは絶対に使いません。複数の理由を自然に組み込むことができます。ユーザーのコメントがある場合は、それを最優先で反映します。",
+            user_prompt=prompt,
             temperature=0.7,
             max_tokens=200,
-            stream=True
-        )
-        
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+            use_cache=use_cache
+        ))
                 
     except Exception as e:
         print(f"投稿文生成エラー: {e}")
@@ -833,8 +740,86 @@ SNSの個人投稿として、本人の生々しい感情を表現する短い
             default_post = f"楽しみにしていた #{event_name}。{comment[:50]}{'...' if len(comment) > 50 else ''}😭"
         else:
             default_post = f"楽しみにしていた #{event_name}。でも{reason_text}で泣く泣く断念…😭"
-        for char in default_post:
-            yield char
+        yield default_post
+
+# AI生成のバックグラウンド実行
+GENERATION_POLL_INTERVAL = openai_client.STREAM_FRAME_INTERVAL  # 途中経過を画面に反映する間隔（秒）
+
+class GenerationJob:
+    """生成ジェネレーターを別スレッドで実行し、途中までの文章を保持するジョブ"""
+    
+    def __init__(self, make_stream, fallback):
+        self._lock = threading.Lock()
+        self._parts = []
+        self._done = threading.Event()
+        self._fallback = fallback
+        self._thread = threading.Thread(target=self._run, args=(make_stream,), daemon=True)
+        # st.secretsやキャッシュをスレッド内から使えるようにする
+        add_script_run_ctx(self._thread, get_script_run_ctx())
+        self._thread.start()
+    
+    def _run(self, make_stream):
+        try:
+            for chunk in make_stream():
+                with self._lock:
+                    self._parts.append(chunk)
+        except Exception as e:
+            print(f"バックグラウンド生成エラー: {e}")
+            with self._lock:
+                self._parts = [self._fallback]
+        finally:
+            self._done.set()
+    
+    @property
+    def done(self):
+        return self._done.is_set()
+    
+    @property
+    def text(self):
+        with self._lock:
+            return "".join(self._parts)
+    
+    def follow(self):
+        """生成が終わるまで、文章が伸びるたびにそこまでの全文を返す"""
+        shown = None
+        while True:
+            finished = self._done.wait(GENERATION_POLL_INTERVAL)
+            text = self.text
+            if text != shown:
+                shown = text
+                yield text
+            if finished:
+                return
+
+def start_post_generation(form_data, use_cache=True):
+    """SNS投稿文の生成をバックグラウンドで開始"""
+    reason_text = "、".join(form_data['selected_reasons'][:3])
+    st.session_state.post_job = GenerationJob(
+        lambda: generate_engaging_post_stream(
+            form_data['event_name'],
+            form_data['selected_reasons'],
+            form_data['comment'],
+            form_data['event_location_selected'],
+            use_cache=use_cache
+        ),
+        fallback=f"楽しみにしていた #{form_data['event_name']}。でも{reason_text}で泣く泣く断念…😭"
+    )
+    return st.session_state.post_job
+
+def get_empathy_generation(form_data):
+    """共感メッセージの生成ジョブを取得（同じ入力なら確認画面で開始したものを使い回す）"""
+    job_key = (form_data['event_name'], tuple(form_data['selected_reasons']), form_data['comment'])
+    if st.session_state.get('empathy_job_key') != job_key:
+        st.session_state.empathy_job = GenerationJob(
+            lambda: generate_empathy_comment_stream(
+                form_data['event_name'],
+                form_data['selected_reasons'],
+                form_data['comment']
+            ),
+            fallback=EMPATHY_FALLBACK_MESSAGE
+        )
+        st.session_state.empathy_job_key = job_key
+    return st.session_state.empathy_job
 
 def display_threads_style_posts(df, title="📱 みんなの投稿", posts_per_page=20):
     """Threads風の投稿一覧を表示（「次の○件を読み込む」ボタン付き）"""
@@ -886,18 +871,15 @@ def display_threads_style_posts(df, title="📱 みんなの投稿", posts_per_p
                 else:
                     location_text += f" {row['event_municipality']}"
         
-        # 投稿時間の整理
+        # イベントページのプレビュー（裏で取得済みのものだけ）
+        preview_html = ""
+        if row.get('event_url') and str(row['event_url']).strip():
+            preview_html = ui_components.build_url_preview_html(row['event_url'])
+        
+        # 投稿時間の整理（読み込み時にdatetime型へ変換済み）
         post_time = ""
-        if row.get('submission_date'):
-            try:
-                from datetime import datetime
-                if isinstance(row['submission_date'], str):
-                    post_date = datetime.strptime(row['submission_date'][:19], "%Y-%m-%d %H:%M:%S")
-                else:
-                    post_date = row['submission_date']
-                post_time = post_date.strftime("%m/%d %H:%M")
-            except:
-                post_time = str(row['submission_date'])[:16]
+        if pd.notna(row.get('submission_date')):
+            post_time = row['submission_date'].strftime("%m/%d %H:%M")
         
         # Threads風カード（タグ表示を修正）
         st.markdown(f'''
@@ -912,6 +894,7 @@ def display_threads_style_posts(df, title="📱 みんなの投稿", posts_per_p
             <div class="threads-card-content">
                 {main_content}
             </div>
+            {preview_html}
             <div class="threads-card-meta">
                 <span>{location_text}</span>
                 <span>💬 #行きたかったマップ</span>
@@ -993,7 +976,12 @@ def handle_event_location_search():
 def main():
     # 初期化
     logic.migrate_csv_if_needed()
-    df = cached_load_data()
+    # 前回の起動で書き込めなかった投稿を、次の投稿を待たずに再送する
+    logic.get_submission_queue()
+    df = logic.load_data()
+    
+    # 投稿済みURLのプレビュー情報を裏で取得しておく
+    url_metadata.backfill_event_urls(logic.get_post_store().revision)
     
     # セッション状態の初期化
     if 'stage' not in st.session_state:
@@ -1106,10 +1094,7 @@ def main():
                 
                 with col3:
                     # 理由フィルタ
-                    all_reasons = []
-                    for reasons_str in df['reasons'].dropna():
-                        all_reasons.extend(str(reasons_str).split('|'))
-                    unique_reasons = ["すべて"] + sorted(list(set(all_reasons)))[:10]  # 上位10件のみ
+                    unique_reasons = ["すべて"] + sorted(logic.get_reason_table()['reason'].unique())[:10]  # 上位10件のみ
                     selected_reason = st.selectbox("理由", unique_reasons)
             
             # フィルタ適用
@@ -1119,21 +1104,11 @@ def main():
                 filtered_df = filtered_df[filtered_df['event_prefecture'] == selected_pref]
             
             if selected_reason != "すべて":
-                filtered_df = filtered_df[filtered_df['reasons'].str.contains(selected_reason, na=False)]
+                filtered_df = logic.filter_by_reasons(filtered_df, selected_reason)
             
             if selected_time != "すべて":
-                filtered_df_temp = filtered_df.copy()
-                filtered_df_temp['submission_date'] = pd.to_datetime(filtered_df_temp['submission_date'], errors='coerce')
-                current_time = datetime.now()
-                
-                if selected_time == "最近1週間":
-                    cutoff = current_time - pd.Timedelta(days=7)
-                elif selected_time == "最近1ヶ月":
-                    cutoff = current_time - pd.Timedelta(days=30)
-                elif selected_time == "最近3ヶ月":
-                    cutoff = current_time - pd.Timedelta(days=90)
-                
-                filtered_df = filtered_df_temp[filtered_df_temp['submission_date'] > cutoff]
+                # 投稿ストアのデータを絞り込んだだけなので日時順のまま
+                filtered_df = ui_components.apply_date_filter(filtered_df, selected_time, sorted_by_time=True)
             
             # フィルタが変更された場合、表示件数をリセット
             filter_key = f"{selected_pref}_{selected_time}_{selected_reason}"
@@ -1437,14 +1412,14 @@ def main():
                     
                     generated_text = ""
                     
+                    # 投稿文と完了画面の共感メッセージを同時に生成し始める
+                    post_job = start_post_generation(
+                        form_data, use_cache=not st.session_state.get('regenerate_post', False)
+                    )
+                    get_empathy_generation(form_data)
+                    
                     try:
-                        for chunk in generate_engaging_post_stream(
-                            form_data['event_name'],
-                            form_data['selected_reasons'],
-                            form_data['comment'],
-                            form_data['event_location_selected']
-                        ):
-                            generated_text += chunk
+                        for generated_text in post_job.follow():
                             # Threads風プレビュー表示
                             post_placeholder.markdown(f'''
                             <div class="threads-post-box">
@@ -1463,6 +1438,7 @@ def main():
                         
                         st.session_state.generated_post_content = generated_text
                         st.session_state.post_content_generated = True
+                        st.session_state.regenerate_post = False
                         
                     except Exception as e:
                         print(f"投稿文生成エラー: {e}")
@@ -1511,6 +1487,7 @@ def main():
                         if st.button("🔄 投稿文を再生成", use_container_width=True):
                             st.session_state.post_content_generated = False
                             st.session_state.user_edited_post = ""
+                            st.session_state.regenerate_post = True  # キャッシュを使わずに作り直す
                             st.rerun()
                 
                 # 投稿文の編集機能
@@ -1582,7 +1559,6 @@ def main():
                             st.session_state.stage = 'success'
                             st.session_state.ai_comment = ""
                             st.session_state.ai_comment_generated = False
-                            st.cache_data.clear()
                             st.session_state.is_submitting = False
                             st.rerun()
                         else:
@@ -1626,9 +1602,9 @@ def main():
                 st.markdown(f"🔗 **イベントURL:** [{form_data['event_url']}]({form_data['event_url']})")
                 
                 # URLプレビューの表示
-                url_metadata = get_url_metadata(form_data['event_url'])
-                if url_metadata:
-                    display_url_preview(url_metadata)
+                event_metadata = get_url_metadata(form_data['event_url'])
+                if event_metadata:
+                    display_url_preview(event_metadata)
             
             if form_data['comment']:
                 st.write(f"💭 **元のコメント:** {form_data['comment']}")
@@ -1650,12 +1626,8 @@ def main():
                 generated_text = ""
                 
                 try:
-                    for chunk in generate_empathy_comment_stream(
-                        form_data['event_name'],
-                        form_data['selected_reasons'],
-                        form_data['comment']
-                    ):
-                        generated_text += chunk
+                    # 確認画面で開始した生成の続きを表示（終わっていれば即座に全文）
+                    for generated_text in get_empathy_generation(form_data).follow():
                         message_placeholder.markdown(f'<div class="ai-message-box">{generated_text}</div>', unsafe_allow_html=True)
                     
                     st.session_state.ai_comment = generated_text
@@ -1663,7 +1635,7 @@ def main():
                     
                 except Exception as e:
                     print(f"ストリーミング生成エラー: {e}")
-                    default_message = "お忙しい中、貴重な体験を共有していただきありがとうございます。\n\n行きたかったけど行けなかった気持ち、本当によく分かります。特に子育て中は、自分の時間を作ることすら難しいですよね。\n\nあなたのこの声はとても大切です。一人ひとりの「行きたかった」が集まることで、より参加しやすい社会を作る力になります。"
+                    default_message = EMPATHY_FALLBACK_MESSAGE
                     
                     message_placeholder.markdown(f'<div class="ai-message-box">{default_message}</div>', unsafe_allow_html=True)
                     
@@ -1712,6 +1684,7 @@ def main():
                     st.session_state.form_data = {}
                     st.session_state.ai_comment = ""
                     st.session_state.ai_comment_generated = False
+                    st.session_state.empathy_job_key = None
                     st.session_state.is_submitting = False
                     st.session_state.confirmation_shown = False  # 確認状態もリセット
                     st.session_state.event_search_clicked = False
@@ -1745,15 +1718,43 @@ def main():
             map_col, list_col = st.columns([1.2, 1])
             
             with map_col:
-                if st.session_state.map_mode == 'prefecture':
+                map_view = st.radio(
+                    "表示方法",
+                    ["都道府県・市区町村", "全国クラスタ"],
+                    horizontal=True,
+                    key="map_view"
+                )
+                
+                if map_view == "全国クラスタ":
+                    # 全国の投稿を近い地点ごとにまとめたマップ
+                    st.markdown("### 🗺️ 全国の投稿クラスタ")
+                    
+                    # Streamlitでは地図のズーム操作を受け取れないため、細かさを選んでもらう
+                    zoom_level = st.select_slider(
+                        "表示の細かさ",
+                        options=logic.CLUSTER_ZOOM_LEVELS,
+                        value=5,
+                        format_func=lambda level: f"ズーム {level}",
+                        key="cluster_zoom"
+                    )
+                    
+                    deck = map_utils.get_cluster_deck(zoom_level)
+                    if deck:
+                        st.pydeck_chart(deck, use_container_width=True, key="cluster_map")
+                    else:
+                        st.info("🗺️ 表示する地域データがありません")
+                
+                elif st.session_state.map_mode == 'prefecture':
                     # 都道府県レベルのマップ
                     st.markdown("### 🗺️ 都道府県別の分布")
                     
+                    show_heatmap = st.checkbox("🔥 投稿の密度をヒートマップで重ねる", key="show_heatmap")
+                    
                     prefecture_data = logic.count_by_prefecture()
                     
                     if not prefecture_data.empty:
                         # マップの作成と表示
-                        deck = map_utils.create_prefecture_map(prefecture_data, st.session_state.selected_prefecture)
+                        deck = map_utils.get_prefecture_deck(st.session_state.selected_prefecture, show_heatmap)
                         
                         if deck:
                             # 選択機能を有効にして表示
@@ -1817,8 +1818,7 @@ def main():
                     municipality_data = logic.count_by_municipality_in_prefecture(st.session_state.selected_prefecture)
                     
                     if not municipality_data.empty:
-                        deck = map_utils.create_municipality_map(
-                            municipality_data, 
+                        deck = map_utils.get_municipality_deck(
                             st.session_state.selected_prefecture,
                             st.session_state.selected_municipality
                         )